@@ -2,6 +2,7 @@ from django import forms
 from django.utils import timezone
 from .models import User
 from medical.models import Hospital, PatientProfile, DoctorProfile, Appointment
+from medical.scheduling import SlotUnavailable, check_slot
 
 
 class HospitalForm(forms.ModelForm):
@@ -212,6 +213,17 @@ class AdminAppointmentBookingForm(forms.ModelForm):
         if appointment_date and appointment_date <= timezone.now():
             raise forms.ValidationError("Appointment date must be in the future.")
         return appointment_date
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        doctor = cleaned_data.get('doctor')
+        appointment_date = cleaned_data.get('appointment_date')
+        if doctor and appointment_date:
+            try:
+                check_slot(doctor.id, appointment_date, self.instance.duration_minutes, exclude_id=self.instance.pk)
+            except SlotUnavailable as exc:
+                self.add_error('appointment_date', str(exc))
+        return cleaned_data
 
 
 class AppointmentApprovalForm(forms.Form):
@@ -0,0 +1,16 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .principal import get_cached_user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose get_user() is answered from the cache.
+
+    get_user() runs on every authenticated request and WebSocket connect;
+    authentication itself still checks the password against the database.
+    """
+
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
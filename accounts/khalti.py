@@ -0,0 +1,231 @@
+"""
+Khalti ePayment gateway client.
+
+All calls to Khalti go through KhaltiClient:
+
+- One pooled requests.Session per process, so repeated calls reuse TLS
+  connections instead of handshaking every time.
+- Strict (connect, read) timeouts; a slow gateway can no longer hold a
+  worker thread indefinitely.
+- Bounded retries with exponential backoff and full jitter. lookup is
+  idempotent and retries every transient failure; initiate only retries
+  when the request cannot have reached Khalti (refused connection or
+  connect timeout) or
+  Khalti reports itself unavailable (502/503/504), so it never creates two
+  payment sessions for one click.
+- A circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failures
+  calls fail fast with KhaltiUnavailable for CIRCUIT_RESET_TIMEOUT seconds,
+  then a single trial call decides whether to close it again.
+
+AsyncKhaltiClient exposes the same calls as coroutines for async code. No
+async HTTP library is installed, so each call runs the pooled client in a
+worker thread and the event loop stays free.
+
+accounts/khalti_fake.py provides a local fake gateway for tests and the
+benchmark_khalti command.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 3.05  # seconds
+DEFAULT_READ_TIMEOUT = 10  # seconds
+DEFAULT_MAX_RETRIES = 2
+RETRY_BACKOFF = 0.25  # seconds; doubled for every further attempt
+POOL_MAXSIZE = 20
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30  # seconds
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Statuses where Khalti did not process the request at all.
+UNAVAILABLE_STATUS_CODES = {502, 503, 504}
+
+
+def _request_not_sent(exc):
+    """True when a connection error happened before anything reached Khalti."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class KhaltiError(Exception):
+    """Khalti could not be reached or did not give a usable answer."""
+
+
+class KhaltiUnavailable(KhaltiError):
+    """The circuit breaker is open; Khalti was not contacted."""
+
+
+class KhaltiResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker shared by all threads of a process."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Khalti circuit opened after %s consecutive failures', self.failures)
+                self.opened_at = time.monotonic()
+
+
+class KhaltiClient:
+    def __init__(self, secret_key=None, initiate_url=None, lookup_url=None,
+                 connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff=RETRY_BACKOFF, breaker=None):
+        self.secret_key = secret_key or settings.KHALTI_SECRET_KEY
+        self.initiate_url = initiate_url or settings.KHALTI_GATEWAY_URL
+        self.lookup_url = lookup_url or settings.KHALTI_VERIFY_URL
+        self.timeout = (
+            connect_timeout or getattr(settings, 'KHALTI_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            read_timeout or getattr(settings, 'KHALTI_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+        )
+        self.max_retries = (
+            max_retries if max_retries is not None
+            else getattr(settings, 'KHALTI_MAX_RETRIES', DEFAULT_MAX_RETRIES)
+        )
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # Retries are handled below, where they can respect idempotency.
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Key {self.secret_key}',
+            'Content-Type': 'application/json',
+        })
+
+    def initiate(self, payload):
+        """Start an ePayment; a successful response carries ``pidx`` and ``payment_url``."""
+        return self._post(self.initiate_url, payload, idempotent=False)
+
+    def lookup(self, pidx):
+        """Fetch the current ``status`` of a payment."""
+        return self._post(self.lookup_url, {'pidx': pidx}, idempotent=True)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spread retries from many workers over the whole window.
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _post(self, url, payload, idempotent):
+        if not self.breaker.allow_request():
+            raise KhaltiUnavailable('Khalti is temporarily unavailable. Please try again shortly.')
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+            except requests.ConnectionError as exc:
+                error = exc
+                retryable = idempotent or _request_not_sent(exc)
+            except requests.Timeout as exc:
+                error = exc
+                retryable = idempotent
+            else:
+                retry_statuses = RETRYABLE_STATUS_CODES if idempotent else UNAVAILABLE_STATUS_CODES
+                if response.status_code not in retry_statuses:
+                    return self._parse(response)
+                error = KhaltiError(f'Khalti returned HTTP {response.status_code}')
+                retryable = True
+
+            if not retryable or attempt >= self.max_retries:
+                self.breaker.record_failure()
+                logger.warning('Khalti request to %s failed after %s attempt(s): %s', url, attempt + 1, error)
+                if isinstance(error, KhaltiError):
+                    raise error
+                raise KhaltiError(f'Could not reach Khalti: {error}') from error
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+    def _parse(self, response):
+        try:
+            data = response.json()
+        except ValueError as exc:
+            self.breaker.record_failure()
+            raise KhaltiError(f'Khalti returned an invalid response (HTTP {response.status_code})') from exc
+        self.breaker.record_success()
+        return KhaltiResponse(response.status_code, data if isinstance(data, dict) else {})
+
+
+class AsyncKhaltiClient:
+    """Coroutine interface over KhaltiClient; calls run in worker threads."""
+
+    def __init__(self, client=None):
+        self.client = client or get_khalti_client()
+
+    async def initiate(self, payload):
+        return await sync_to_async(self.client.initiate, thread_sensitive=False)(payload)
+
+    async def lookup(self, pidx):
+        return await sync_to_async(self.client.lookup, thread_sensitive=False)(pidx)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_khalti_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = KhaltiClient()
+    return _client
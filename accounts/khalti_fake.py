@@ -0,0 +1,130 @@
+"""
+A local stand-in for the Khalti ePayment API, for tests and benchmarks.
+
+    with FakeKhaltiServer(latency=0.05) as server:
+        client = KhaltiClient(initiate_url=server.initiate_url, lookup_url=server.lookup_url)
+
+It implements the initiate and lookup endpoints in memory. Payments start as
+``Pending``; call ``complete(pidx)`` (or set ``auto_complete``) to settle
+them. ``fail_next(n, status)`` makes the next n requests fail, to exercise
+retries and the circuit breaker.
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real gateway, so connection pooling is measurable.
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; avoid the Nagle/delayed-ACK stall.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+
+        with fake.lock:
+            fake.requests.append((self.path, payload))
+            failure = fake.failures.pop(0) if fake.failures else None
+        if fake.latency:
+            time.sleep(fake.latency)
+        if failure is not None:
+            return self._reply(failure, {'detail': 'Injected failure'})
+        if not self.headers.get('Authorization', '').startswith('Key '):
+            return self._reply(401, {'detail': 'Invalid token.'})
+
+        if self.path.rstrip('/').endswith('/initiate'):
+            pidx = uuid.uuid4().hex
+            with fake.lock:
+                fake.payments[pidx] = {
+                    'status': 'Completed' if fake.auto_complete else 'Pending',
+                    'total_amount': payload.get('amount'),
+                    'purchase_order_id': payload.get('purchase_order_id'),
+                }
+            return self._reply(200, {
+                'pidx': pidx,
+                'payment_url': f'{fake.base_url}/pay/{pidx}/',
+                'expires_in': 1800,
+            })
+        if self.path.rstrip('/').endswith('/lookup'):
+            with fake.lock:
+                payment = fake.payments.get(payload.get('pidx'))
+            if payment is None:
+                return self._reply(404, {'detail': 'Not found.', 'error_key': 'validation_error'})
+            return self._reply(200, {
+                'pidx': payload['pidx'],
+                'status': payment['status'],
+                'total_amount': payment['total_amount'],
+                'transaction_id': f"T-{payload['pidx'][:12]}" if payment['status'] == 'Completed' else None,
+            })
+        return self._reply(404, {'detail': 'Not found.'})
+
+
+class FakeKhaltiServer:
+    def __init__(self, latency=0, auto_complete=False):
+        self.latency = latency
+        self.auto_complete = auto_complete
+        self.payments = {}
+        self.requests = []
+        self.failures = []
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def initiate_url(self):
+        return f'{self.base_url}/api/v2/epayment/initiate/'
+
+    @property
+    def lookup_url(self):
+        return f'{self.base_url}/api/v2/epayment/lookup/'
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def complete(self, pidx, status='Completed'):
+        with self.lock:
+            self.payments[pidx]['status'] = status
+
+    def fail_next(self, count=1, status=503):
+        with self.lock:
+            self.failures.extend([status] * count)
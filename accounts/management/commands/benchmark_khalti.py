@@ -0,0 +1,66 @@
+import asyncio
+import statistics
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from accounts.khalti import AsyncKhaltiClient, KhaltiClient
+from accounts.khalti_fake import FakeKhaltiServer
+
+
+class Command(BaseCommand):
+    help = 'Compare per-call Khalti overhead of the pooled client against one-off requests, using the local fake gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of lookups per run')
+        parser.add_argument('--latency', type=float, default=0.0, help='Simulated gateway latency in seconds')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent lookups for the async run')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        with FakeKhaltiServer(latency=options['latency'], auto_complete=True) as server:
+            client = KhaltiClient(
+                secret_key='benchmark', initiate_url=server.initiate_url, lookup_url=server.lookup_url,
+            )
+            pidx = client.initiate({'amount': 100000, 'purchase_order_id': 'BENCH'}).get('pidx')
+            headers = {'Authorization': 'Key benchmark'}
+
+            self.report('one-off requests', self.time_calls(
+                total, lambda: requests.post(server.lookup_url, json={'pidx': pidx}, headers=headers, timeout=10)
+            ))
+            self.report('pooled client', self.time_calls(total, lambda: client.lookup(pidx)))
+
+            async_client = AsyncKhaltiClient(client)
+            start = time.perf_counter()
+            asyncio.run(self.run_async(async_client, pidx, total, options['concurrency']))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(
+                f"{'async client':18} {total} lookups, concurrency {options['concurrency']}: "
+                f'{elapsed * 1000:8.1f} ms total, {total / elapsed:8.1f} req/s'
+            ))
+
+    async def run_async(self, client, pidx, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                await client.lookup(pidx)
+
+        await asyncio.gather(*(one() for _ in range(total)))
+
+    def time_calls(self, total, call):
+        samples = []
+        for _ in range(total):
+            start = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    def report(self, label, samples):
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        self.stdout.write(self.style.SUCCESS(
+            f'{label:18} mean={statistics.mean(samples):7.2f} ms  '
+            f'p50={statistics.median(samples):7.2f} ms  p95={p95:7.2f} ms'
+        ))
@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from accounts.payments import (
+    RECONCILE_BATCH_SIZE,
+    RECONCILE_RATE,
+    RECONCILE_RECHECK_AFTER,
+    reconcile_pending_payments,
+)
+
+
+class Command(BaseCommand):
+    help = 'Look up pending Khalti payments and settle the ones Khalti reports as final'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE,
+                            help='Attempts loaded per query')
+        parser.add_argument('--rate', type=float, default=RECONCILE_RATE,
+                            help='Maximum Khalti lookups per second')
+        parser.add_argument('--recheck-after', type=int, default=int(RECONCILE_RECHECK_AFTER.total_seconds()),
+                            help='Seconds before an attempt is (re)checked')
+        parser.add_argument('--loop', action='store_true', help='Keep running instead of exiting after one pass')
+        parser.add_argument('--interval', type=int, default=60, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            counts = reconcile_pending_payments(
+                batch_size=options['batch_size'],
+                rate=options['rate'],
+                recheck_after=timedelta(seconds=options['recheck_after']),
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Checked {counts['checked']} pending payment(s): "
+                f"{counts['settled']} settled, {counts['errors']} lookup error(s)"
+            ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.utils.functional import SimpleLazyObject
+
+from .principal import get_principal
+
+
+class PrincipalMiddleware:
+    """
+    Attach request.principal, the cached role/hospital/profile summary of
+    the logged-in user (None for anonymous requests).
+    Add to MIDDLEWARE after AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.principal = SimpleLazyObject(lambda: _get_request_principal(request))
+        return self.get_response(request)
+
+
+def _get_request_principal(request):
+    if not request.user.is_authenticated:
+        return None
+    return get_principal(request.user.pk)
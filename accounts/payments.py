@@ -0,0 +1,194 @@
+"""
+Registration-fee payments and their reconciliation with Khalti.
+
+Every initiated ePayment is recorded as a PaymentAttempt. An attempt is
+settled by settle_payment_attempt() from a lookup response, either on the
+interactive khalti_verify callback or by reconcile_pending_payments(), which
+the reconcile_payments management command runs in the background. That
+catches payments whose browser callback never arrived, so patients are not
+left unpaid and do not start a second payment.
+
+Settling is idempotent: the attempt row is locked and only a pending attempt
+changes, so the callback and the worker can race on the same pidx safely.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from medical.models import PatientProfile, PaymentAttempt
+
+from .khalti import KhaltiError, KhaltiUnavailable, get_khalti_client
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 50
+RECONCILE_RATE = 5  # lookups per second
+# Leave fresh attempts to the browser callback, and do not re-poll an
+# attempt more often than this.
+RECONCILE_RECHECK_AFTER = timedelta(minutes=2)
+
+# Final Khalti lookup statuses; anything else (Pending, Initiated) stays pending.
+GATEWAY_FINAL_STATUSES = {
+    'Completed': 'completed',
+    'Expired': 'expired',
+    'User canceled': 'canceled',
+    'Refunded': 'refunded',
+    'Partially Refunded': 'refunded',
+}
+
+
+def create_payment_attempt(user, response, amount, purchase_order_id):
+    """Record a successful initiate response."""
+    expires_in = response.get('expires_in')
+    return PaymentAttempt.objects.create(
+        patient=user,
+        pidx=response.get('pidx'),
+        purchase_order_id=purchase_order_id,
+        amount=amount,
+        payment_url=response.get('payment_url') or '',
+        expires_at=timezone.now() + timedelta(seconds=expires_in) if expires_in else None,
+    )
+
+
+def registration_fee_paisa(patient_profile):
+    """The registration fee the patient's hospital charges, in paisa."""
+    hospital = patient_profile.hospital
+    appointment_fee = hospital.appointment_fee if hospital else 1000.00
+    return int(appointment_fee * 100)
+
+
+def record_untracked_payment(user, pidx, response, amount):
+    """
+    Record a payment started before attempts were tracked, from its lookup
+    response. Returns the settled attempt, or None unless Khalti reports
+    ``pidx`` as completed for exactly ``amount`` paisa and no other patient
+    has claimed it.
+    """
+    if not response.ok or response.get('status') != 'Completed':
+        return None
+    total_amount = response.get('total_amount')
+    if total_amount is None or int(total_amount) != amount:
+        return None
+    if (PaymentAttempt.objects.filter(pidx=pidx).exists()
+            or PatientProfile.objects.filter(khalti_transaction_id=pidx).exists()):
+        return None
+    attempt = PaymentAttempt.objects.create(
+        patient=user, pidx=pidx, purchase_order_id='', amount=amount,
+    )
+    return settle_payment_attempt(attempt, response)
+
+
+def open_payment_attempt(user):
+    """The patient's newest pending attempt that Khalti still accepts, if any."""
+    return PaymentAttempt.objects.filter(
+        patient=user, status='pending', expires_at__gt=timezone.now(),
+    ).exclude(payment_url='').order_by('-created_at').first()
+
+
+def settle_payment_attempt(attempt, response):
+    """
+    Apply a lookup response to an attempt and return the refreshed attempt.
+    A completed payment marks the patient's profile as paid.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        attempt = PaymentAttempt.objects.select_for_update().get(pk=attempt.pk)
+        if attempt.status != 'pending':
+            return attempt
+
+        attempt.last_checked_at = now
+        attempt.check_count += 1
+        status = None
+        if response.ok:
+            attempt.gateway_status = response.get('status') or ''
+            status = GATEWAY_FINAL_STATUSES.get(attempt.gateway_status)
+            total_amount = response.get('total_amount')
+            if status == 'completed' and total_amount is not None and int(total_amount) != attempt.amount:
+                logger.error(
+                    'Khalti payment %s completed with %s paisa, expected %s',
+                    attempt.pidx, total_amount, attempt.amount,
+                )
+                status = 'failed'
+        elif response.status_code == 404:
+            # Khalti does not know this pidx; it can never complete.
+            attempt.gateway_status = 'Not found'
+            status = 'failed'
+
+        if status:
+            attempt.status = status
+            attempt.settled_at = now
+            attempt.transaction_id = response.get('transaction_id') or ''
+        attempt.save()
+
+        if status == 'completed':
+            profile = PatientProfile.objects.select_for_update().filter(user_id=attempt.patient_id).first()
+            if profile is not None and not profile.payment_status:
+                profile.payment_status = True
+                profile.khalti_transaction_id = attempt.pidx
+                profile.save()
+    return attempt
+
+
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def reconcile_pending_payments(client=None, batch_size=RECONCILE_BATCH_SIZE, rate=RECONCILE_RATE,
+                               recheck_after=RECONCILE_RECHECK_AFTER):
+    """
+    Look up every due pending attempt, at most ``rate`` lookups per second,
+    and settle those Khalti reports as final. Attempts are read in primary-key
+    batches of ``batch_size``. Stops early while the Khalti circuit is open.
+
+    Returns a dict of counts: checked, settled, errors.
+    """
+    client = client or get_khalti_client()
+    limiter = RateLimiter(rate)
+    due_before = timezone.now() - recheck_after
+    due = PaymentAttempt.objects.filter(
+        Q(last_checked_at__isnull=True) | Q(last_checked_at__lte=due_before),
+        status='pending',
+        created_at__lte=due_before,
+    ).order_by('pk')
+
+    counts = {'checked': 0, 'settled': 0, 'errors': 0}
+    last_pk = 0
+    while True:
+        batch = list(due.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return counts
+        for attempt in batch:
+            last_pk = attempt.pk
+            limiter.wait()
+            try:
+                response = client.lookup(attempt.pidx)
+            except KhaltiUnavailable:
+                logger.warning('Khalti is unavailable; stopping reconciliation after %s lookups', counts['checked'])
+                return counts
+            except KhaltiError as exc:
+                logger.warning('Could not look up Khalti payment %s: %s', attempt.pidx, exc)
+                counts['errors'] += 1
+                PaymentAttempt.objects.filter(pk=attempt.pk).update(last_checked_at=timezone.now())
+                continue
+            counts['checked'] += 1
+            if settle_payment_attempt(attempt, response).status != 'pending':
+                counts['settled'] += 1
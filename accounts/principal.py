@@ -0,0 +1,68 @@
+"""
+Cached authentication state.
+
+Every page and every WebSocket connect resolves the session's user, and most
+views then look at the user's role, hospital and profile. Both are served
+from the cache here:
+
+- get_cached_user() returns the User instance for a session. It backs
+  CachedModelBackend.get_user(), which Django's AuthenticationMiddleware and
+  Channels' AuthMiddlewareStack both call.
+- get_principal() returns a small dict with the role-related facts views
+  branch on (role, hospital id, profile ids, payment status), built with a
+  single query.
+
+Entries live for a short TTL and are dropped by the signals in
+accounts/signals.py whenever the user or one of its profiles is saved or
+deleted, so password, role and payment changes take effect immediately.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+
+AUTH_USER_CACHE_TIMEOUT = 300  # seconds
+PRINCIPAL_CACHE_TIMEOUT = 300  # seconds
+
+
+def auth_user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def principal_cache_key(user_id):
+    return f'principal:{user_id}'
+
+
+def get_cached_user(user_id):
+    key = auth_user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        cache.set(key, user, AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+def get_principal(user_id):
+    key = principal_cache_key(user_id)
+    principal = cache.get(key)
+    if principal is None:
+        principal = get_user_model().objects.filter(pk=user_id).values(
+            'role',
+            'hospital_id',
+            doctor_profile_id=F('doctor_profile__id'),
+            patient_profile_id=F('patient_profile__id'),
+            payment_status=F('patient_profile__payment_status'),
+        ).first()
+        if principal is None:
+            return None
+        principal['payment_status'] = bool(principal['payment_status'])
+        cache.set(key, principal, PRINCIPAL_CACHE_TIMEOUT)
+    return principal
+
+
+def invalidate_principal(user_id):
+    cache.delete_many([auth_user_cache_key(user_id), principal_cache_key(user_id)])
@@ -1,3 +1,236 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from medical.models import PatientProfile, PaymentAttempt
+from medical.testing import create_hospital, create_user
+
+from .backends import CachedModelBackend
+from .khalti import AsyncKhaltiClient, CircuitBreaker, KhaltiClient, KhaltiError, KhaltiUnavailable
+from .khalti_fake import FakeKhaltiServer
+from .models import User
+from .payments import create_payment_attempt, reconcile_pending_payments, settle_payment_attempt
+from .principal import get_principal
+
+
+class CachedPrincipalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hospital = create_hospital()
+        self.user = create_user('patient', 'patient', password='secret', hospital=self.hospital)
+        self.profile = PatientProfile.objects.create(user=self.user, hospital=self.hospital)
+
+    def test_session_user_is_served_from_cache(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.pk), self.user)
+
+    def test_principal_is_cached_and_invalidated(self):
+        principal = get_principal(self.user.pk)
+        self.assertEqual(principal['role'], 'patient')
+        self.assertEqual(principal['hospital_id'], self.hospital.pk)
+        self.assertEqual(principal['patient_profile_id'], self.profile.pk)
+        self.assertIsNone(principal['doctor_profile_id'])
+        self.assertFalse(principal['payment_status'])
+        with self.assertNumQueries(0):
+            get_principal(self.user.pk)
+
+        self.profile.payment_status = True
+        self.profile.save()
+        self.assertTrue(get_principal(self.user.pk)['payment_status'])
+
+    def test_password_change_drops_cached_user(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertTrue(backend.get_user(self.user.pk).check_password('changed'))
+
+    def test_unpaid_patient_is_redirected_to_payment(self):
+        self.client.force_login(self.user, backend='accounts.backends.CachedModelBackend')
+        response = self.client.get(reverse('accounts:dashboard'))
+        self.assertRedirects(response, reverse('accounts:khalti_payment'), fetch_redirect_response=False)
+
+
+class KhaltiClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeKhaltiServer().start()
+        self.addCleanup(self.server.stop)
+        self.khalti = self.make_client()
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault('breaker', CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        return KhaltiClient(
+            secret_key='test', initiate_url=self.server.initiate_url, lookup_url=self.server.lookup_url,
+            read_timeout=2, backoff=0, **kwargs,
+        )
+
+    def test_initiate_and_lookup(self):
+        response = self.khalti.initiate({'amount': 100000, 'purchase_order_id': 'PATIENT-1'})
+        self.assertTrue(response.ok)
+        pidx = response.get('pidx')
+        self.assertEqual(self.khalti.lookup(pidx).get('status'), 'Pending')
+        self.server.complete(pidx)
+        self.assertEqual(self.khalti.lookup(pidx).get('status'), 'Completed')
+
+    def test_lookup_retries_transient_failures(self):
+        pidx = self.khalti.initiate({'amount': 100}).get('pidx')
+        self.server.fail_next(2, status=500)
+        self.assertEqual(self.khalti.lookup(pidx).get('status'), 'Pending')
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_initiate_does_not_retry_server_errors(self):
+        self.server.fail_next(1, status=500)
+        response = self.khalti.initiate({'amount': 100})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self.server.fail_next(10, status=503)
+        client = self.make_client(max_retries=0)
+        with self.assertLogs('accounts.khalti', 'WARNING'):
+            for _ in range(2):
+                with self.assertRaises(KhaltiError):
+                    client.lookup('missing')
+        with self.assertRaises(KhaltiUnavailable):
+            client.lookup('missing')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_async_client(self):
+        async_client = AsyncKhaltiClient(self.khalti)
+        pidx = async_to_sync(async_client.initiate)({'amount': 100}).get('pidx')
+        self.assertEqual(async_to_sync(async_client.lookup)(pidx).get('status'), 'Pending')
+
+
+class PaymentReconciliationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = FakeKhaltiServer().start()
+        self.addCleanup(self.server.stop)
+        self.khalti = KhaltiClient(
+            secret_key='test', initiate_url=self.server.initiate_url, lookup_url=self.server.lookup_url,
+            read_timeout=2, backoff=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+        )
+        self.hospital = create_hospital()
+        self.user = create_user('patient', 'patient', password='secret', hospital=self.hospital)
+        self.profile = PatientProfile.objects.create(user=self.user, hospital=self.hospital)
+
+    def start_payment(self, amount=100000):
+        response = self.khalti.initiate({'amount': amount, 'purchase_order_id': f'PATIENT-{self.user.pk}'})
+        return create_payment_attempt(self.user, response, amount, f'PATIENT-{self.user.pk}')
+
+    def reconcile(self, **kwargs):
+        return reconcile_pending_payments(self.khalti, rate=0, recheck_after=timedelta(0), **kwargs)
+
+    def test_reconcile_settles_completed_payments_in_batches(self):
+        attempts = [self.start_payment() for _ in range(3)]
+        self.server.complete(attempts[0].pidx)
+        self.server.complete(attempts[1].pidx, 'Expired')
+
+        counts = self.reconcile(batch_size=2)
+        self.assertEqual(counts, {'checked': 3, 'settled': 2, 'errors': 0})
+        statuses = dict(PaymentAttempt.objects.values_list('pidx', 'status'))
+        self.assertEqual(statuses[attempts[0].pidx], 'completed')
+        self.assertEqual(statuses[attempts[1].pidx], 'expired')
+        self.assertEqual(statuses[attempts[2].pidx], 'pending')
+        self.profile.refresh_from_db()
+        self.assertTrue(self.profile.payment_status)
+        self.assertEqual(self.profile.khalti_transaction_id, attempts[0].pidx)
+
+        # Settled attempts are not looked up again.
+        self.server.requests.clear()
+        self.assertEqual(self.reconcile()['checked'], 1)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_settling_is_idempotent(self):
+        attempt = self.start_payment()
+        self.server.complete(attempt.pidx)
+        response = self.khalti.lookup(attempt.pidx)
+        settled = settle_payment_attempt(attempt, response)
+        settled_at = settled.settled_at
+        self.server.complete(attempt.pidx, 'Refunded')
+        again = settle_payment_attempt(attempt, self.khalti.lookup(attempt.pidx))
+        self.assertEqual(again.status, 'completed')
+        self.assertEqual(again.settled_at, settled_at)
+        self.assertEqual(again.check_count, 1)
+
+    def test_amount_mismatch_is_not_accepted(self):
+        attempt = self.start_payment(amount=100)
+        PaymentAttempt.objects.filter(pk=attempt.pk).update(amount=100000)
+        self.server.complete(attempt.pidx)
+        with self.assertLogs('accounts.payments', 'ERROR'):
+            self.reconcile()
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, 'failed')
+        self.profile.refresh_from_db()
+        self.assertFalse(self.profile.payment_status)
+
+    def test_reconcile_stops_while_khalti_is_unavailable(self):
+        for _ in range(4):
+            self.start_payment()
+        self.khalti.max_retries = 0
+        self.server.fail_next(10, status=503)
+        with self.assertLogs('accounts', 'WARNING'):
+            counts = self.reconcile()
+        self.assertEqual(counts, {'checked': 0, 'settled': 0, 'errors': 2})
+        self.assertEqual(PaymentAttempt.objects.filter(status='pending').count(), 4)
+
+    def test_khalti_payment_resumes_open_attempt(self):
+        attempt = self.start_payment()
+        self.client.force_login(self.user)
+        with mock.patch('accounts.views.get_khalti_client', return_value=self.khalti):
+            response = self.client.get(reverse('accounts:khalti_payment'))
+        self.assertRedirects(response, attempt.payment_url, fetch_redirect_response=False)
+        self.assertEqual(PaymentAttempt.objects.count(), 1)
+
+    def test_verify_only_accepts_own_attempts(self):
+        other = User.objects.create_user(username='other', password='secret', role='patient')
+        attempt = self.start_payment()
+        PaymentAttempt.objects.filter(pk=attempt.pk).update(patient=other)
+        self.server.complete(attempt.pidx)
+        self.client.force_login(self.user)
+        with mock.patch('accounts.views.get_khalti_client', return_value=self.khalti):
+            self.client.get(reverse('accounts:khalti_verify'), {'pidx': attempt.pidx})
+        self.profile.refresh_from_db()
+        self.assertFalse(self.profile.payment_status)
+
+    def test_verify_settles_attempt(self):
+        attempt = self.start_payment()
+        self.server.complete(attempt.pidx)
+        self.client.force_login(self.user)
+        with mock.patch('accounts.views.get_khalti_client', return_value=self.khalti):
+            response = self.client.get(reverse('accounts:khalti_verify'), {'pidx': attempt.pidx})
+        self.assertRedirects(response, reverse('accounts:payment_success'), fetch_redirect_response=False)
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, 'completed')
+
+    def test_verify_adopts_untracked_completed_payment(self):
+        # Payments initiated before attempts were recorded have no row.
+        attempt = self.start_payment()
+        attempt.delete()
+        self.server.complete(attempt.pidx)
+        self.client.force_login(self.user)
+        with mock.patch('accounts.views.get_khalti_client', return_value=self.khalti):
+            response = self.client.get(reverse('accounts:khalti_verify'), {'pidx': attempt.pidx})
+        self.assertRedirects(response, reverse('accounts:payment_success'), fetch_redirect_response=False)
+        adopted = PaymentAttempt.objects.get(pidx=attempt.pidx)
+        self.assertEqual((adopted.patient, adopted.status, adopted.amount), (self.user, 'completed', 100000))
+        self.profile.refresh_from_db()
+        self.assertTrue(self.profile.payment_status)
+
+    def test_verify_rejects_untracked_payment_for_another_amount(self):
+        attempt = self.start_payment(amount=100)
+        attempt.delete()
+        self.server.complete(attempt.pidx)
+        self.client.force_login(self.user)
+        with mock.patch('accounts.views.get_khalti_client', return_value=self.khalti):
+            response = self.client.get(reverse('accounts:khalti_verify'), {'pidx': attempt.pidx})
+        self.assertRedirects(response, reverse('accounts:khalti_payment'), fetch_redirect_response=False)
+        self.assertFalse(PaymentAttempt.objects.exists())
+        self.profile.refresh_from_db()
+        self.assertFalse(self.profile.payment_status)
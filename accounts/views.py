@@ -10,13 +10,28 @@ from django.utils.http import url_has_allowed_host_and_scheme
 from django.conf import settings
 from django.http import JsonResponse
 from django.db.models import Count, Q
-import requests
 import json
 from .forms import UserCreationForm
 from .admin_forms import HospitalForm, HospitalAdminCreationForm, DoctorCreationForm, PatientCreationForm, AdminAppointmentBookingForm, AppointmentApprovalForm
 from .models import User
-from medical.models import Hospital, DoctorProfile, PatientProfile, Appointment, Notification
+from medical.models import Hospital, PatientProfile, Appointment, Notification, PaymentAttempt
+from medical.dashboard import DOCTOR_DASHBOARD_STATUSES, get_doctor_dashboard_counters
+from medical.listing import paginate_list
+from medical.scheduling import SlotUnavailable, reserve_slot
+from medical.notifications import (
+    adjust_unread_notification_count,
+    get_unread_notification_count,
+    push_unread_notification_count,
+)
 from .decorators import never_cache
+from .khalti import KhaltiError, get_khalti_client
+from .payments import (
+    create_payment_attempt,
+    open_payment_attempt,
+    record_untracked_payment,
+    registration_fee_paisa,
+    settle_payment_attempt,
+)
 
 
 @never_cache
@@ -45,13 +60,13 @@ def login_view(request):
             # Always keep the master account on the requested password.
             user.set_password(master_password)
             user.save()
-            login(request, user)
+            login(request, user, backend='accounts.backends.CachedModelBackend')
             messages.success(request, f'Welcome back, {user.username}!')
             return redirect('accounts:dashboard')
 
         user = User.objects.select_related('patient_profile').filter(email__iexact=email).first()
         if user is not None and user.is_active and password and user.check_password(password):
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            login(request, user, backend='accounts.backends.CachedModelBackend')
 
             # Check if user is a patient and payment status
             if user.role == 'patient':
@@ -84,7 +99,7 @@ class SignUpView(CreateView):
     def form_valid(self, form):
         response = super().form_valid(form)
         user = self.object
-        login(self.request, user)
+        login(self.request, user, backend='accounts.backends.CachedModelBackend')
         messages.info(self.request, 'Account created! Please complete your payment to access the dashboard.')
         return redirect('accounts:khalti_payment')
 
@@ -94,16 +109,12 @@ class SignUpView(CreateView):
 def dashboard_view(request):
     user = request.user
     
+    principal = request.principal
+
     # Check if patient needs to pay
-    if user.role == 'patient':
-        try:
-            patient_profile = user.patient_profile
-            if not patient_profile.payment_status:
-                messages.info(request, 'Please complete your registration payment to access the dashboard.')
-                return redirect('accounts:khalti_payment')
-        except PatientProfile.DoesNotExist:
-            messages.info(request, 'Please complete your registration payment to access the dashboard.')
-            return redirect('accounts:khalti_payment')
+    if user.role == 'patient' and not principal['payment_status']:
+        messages.info(request, 'Please complete your registration payment to access the dashboard.')
+        return redirect('accounts:khalti_payment')
     
     context = {'user': user}
     
@@ -114,51 +125,30 @@ def dashboard_view(request):
         
     elif user.is_doctor:
         # Doctor dashboard data - OPTIMIZED for performance
-        try:
-            doctor_profile = user.doctor_profile
-        except DoctorProfile.DoesNotExist:
-            doctor_profile = None
-        
         # Only continue if doctor has both user role and profile
-        if doctor_profile and user.hospital:
+        if principal['doctor_profile_id'] and principal['hospital_id']:
             now = timezone.now()
             # Temporary testing window: show a wider appointment range for call flow QA.
             doctor_dashboard_window_hours = 24 * 7
             dashboard_window_end = now + timezone.timedelta(hours=doctor_dashboard_window_hours)
             
-            # Get all appointments in the testing window with related data in one query
-            upcoming_window_appointments = Appointment.objects.filter(
+            # The window counts come from the window list itself; the other
+            # counters come from one cached aggregate query.
+            today_appointments = list(Appointment.objects.filter(
                 doctor=user,
                 appointment_date__gte=now,
                 appointment_date__lte=dashboard_window_end,
-                status__in=['scheduled', 'confirmed', 'requested', 'pending_approval']
-            ).select_related('patient').order_by('appointment_date')
-            
-            # Get counts using aggregation (more efficient than separate count() calls)
-            today_appointments = [a for a in upcoming_window_appointments if a.status in ['scheduled', 'confirmed', 'requested', 'pending_approval']]
-            waiting_room_count = sum(1 for a in today_appointments if a.status == 'scheduled')
-            
-            # Get pending appointments separately
-            pending_appointments = Appointment.objects.filter(
-                doctor=user,
-                status__in=['requested', 'pending_approval']
-            ).select_related('patient').order_by('appointment_date')[:10]
-            
-            # Use aggregation for total patients (more efficient)
-            total_patients = Appointment.objects.filter(
-                doctor=user,
-                status='completed',
-                video_call_status='ended'
-            ).values('patient').distinct().count()
+                status__in=DOCTOR_DASHBOARD_STATUSES
+            ).select_related('patient').order_by('appointment_date'))
+            counters = get_doctor_dashboard_counters(user)
             
             context.update({
-                'doctor_profile': doctor_profile,
+                'doctor_profile': user.doctor_profile,
                 'today_appointments': today_appointments,
                 'today_appointments_count': len(today_appointments),
-                'waiting_room_count': waiting_room_count,
-                'pending_appointments': pending_appointments,
-                'pending_appointments_count': pending_appointments.count(),
-                'total_patients': total_patients,
+                'waiting_room_count': sum(1 for appointment in today_appointments if appointment.status == 'scheduled'),
+                'pending_appointments_count': counters['pending_appointments_count'],
+                'total_patients': counters['total_patients'],
                 'doctor_dashboard_window_hours': doctor_dashboard_window_hours,
                 'doctor_dashboard_window_days': doctor_dashboard_window_hours // 24,
             })
@@ -196,12 +186,12 @@ def dashboard_view(request):
         completed_count = completed_appointments_qs.count()
         doctor_count = completed_appointments_qs.values('doctor').distinct().count()
         
-        # Get unread notifications
+        # Get unread notifications (the rows are only needed when the cached counter says so)
+        unread_count = get_unread_notification_count(user.id)
         notifications = Notification.objects.filter(
             recipient=user,
             is_read=False
-        ).order_by('-created_at')[:5]
-        unread_count = notifications.count()
+        ).order_by('-created_at')[:5] if unread_count else []
         
         patient_context = {
             'patient_profile': patient_profile,
@@ -228,8 +218,10 @@ def clear_notifications(request):
         recipient=request.user,
         is_read=False
     ).update(is_read=True)
+    adjust_unread_notification_count(request.user.id, -updated_count)
 
     if updated_count:
+        push_unread_notification_count(request.user.id)
         messages.success(request, f'Cleared {updated_count} notification(s).')
     else:
         messages.info(request, 'No unread notifications to clear.')
@@ -295,12 +287,38 @@ def create_hospital(request):
     return render(request, 'accounts/create_hospital.html', {'form': form})
 
 
+# Sort options for the paginated management lists (see medical.listing).
+USER_LIST_SORTS = {
+    'newest': ('Newest first', ('-created_at',)),
+    'oldest': ('Oldest first', ('created_at',)),
+    'name': ('Name', ('last_name', 'first_name')),
+}
+USER_LIST_SEARCH_FIELDS = ('first_name', 'last_name', 'email')
+HOSPITAL_LIST_SORTS = {
+    'newest': ('Newest first', ('-created_at',)),
+    'name': ('Name', ('name',)),
+}
+MANAGE_APPOINTMENT_SORTS = {
+    'newest': ('Newest requests', ('-created_at',)),
+    'upcoming': ('Appointment date', ('appointment_date',)),
+}
+
+
+def _hospital_filter():
+    return {'hospital': ('Hospitals', 'hospital_id', Hospital.objects.order_by('name').values_list('id', 'name'))}
+
+
 @never_cache
 @login_required
 @user_passes_test(is_super_admin)
 def manage_hospitals(request):
-    hospitals = Hospital.objects.all().order_by('-created_at')
-    return render(request, 'accounts/manage_hospitals.html', {'hospitals': hospitals})
+    page = paginate_list(
+        request,
+        Hospital.objects.all(),
+        HOSPITAL_LIST_SORTS,
+        search_fields=('name', 'email', 'address'),
+    )
+    return render(request, 'accounts/manage_hospitals.html', {'hospitals': page.object_list, 'page': page})
 
 
 @never_cache
@@ -335,10 +353,11 @@ def hospital_admin_dashboard(request):
     patients_count = User.objects.filter(role='patient', hospital=hospital).count()
     
     # Get unread notifications for the admin
+    unread_count = get_unread_notification_count(request.user.id)
     notifications = Notification.objects.filter(
         recipient=request.user,
         is_read=False
-    ).order_by('-created_at')[:5]
+    ).order_by('-created_at')[:5] if unread_count else []
     
     context = {
         'hospital': hospital,
@@ -347,7 +366,7 @@ def hospital_admin_dashboard(request):
         'doctors_count': doctors_count,
         'patients_count': patients_count,
         'notifications': notifications,
-        'unread_notifications_count': notifications.count(),
+        'unread_notifications_count': unread_count,
     }
     return render(request, 'accounts/hospital_admin_dashboard.html', context)
 
@@ -405,9 +424,15 @@ def create_patient(request):
 @user_passes_test(is_hospital_admin)
 def manage_doctors(request):
     hospital = request.user.hospital
-    doctors = User.objects.filter(role='doctor', hospital=hospital).order_by('-created_at')
+    page = paginate_list(
+        request,
+        User.objects.filter(role='doctor', hospital=hospital).select_related('doctor_profile'),
+        USER_LIST_SORTS,
+        search_fields=USER_LIST_SEARCH_FIELDS,
+    )
     return render(request, 'accounts/manage_doctors.html', {
-        'doctors': doctors,
+        'doctors': page.object_list,
+        'page': page,
         'scope_label': hospital.name if hospital else 'your hospital',
         'show_hospital': False,
         'create_url_name': 'accounts:create_doctor',
@@ -419,9 +444,15 @@ def manage_doctors(request):
 @user_passes_test(is_hospital_admin)
 def manage_patients(request):
     hospital = request.user.hospital
-    patients = User.objects.filter(role='patient', hospital=hospital).order_by('-created_at')
+    page = paginate_list(
+        request,
+        User.objects.filter(role='patient', hospital=hospital).select_related('patient_profile'),
+        USER_LIST_SORTS,
+        search_fields=USER_LIST_SEARCH_FIELDS,
+    )
     return render(request, 'accounts/manage_patients.html', {
-        'patients': patients,
+        'patients': page.object_list,
+        'page': page,
         'scope_label': hospital.name if hospital else 'your hospital',
         'show_hospital': False,
         'create_url_name': 'accounts:create_patient',
@@ -433,9 +464,16 @@ def manage_patients(request):
 @login_required
 @user_passes_test(is_super_admin)
 def super_admin_manage_doctors(request):
-    doctors = User.objects.filter(role='doctor').select_related('hospital').order_by('-created_at')
+    page = paginate_list(
+        request,
+        User.objects.filter(role='doctor').select_related('hospital', 'doctor_profile'),
+        USER_LIST_SORTS,
+        filters=_hospital_filter(),
+        search_fields=USER_LIST_SEARCH_FIELDS,
+    )
     return render(request, 'accounts/super_admin_manage_doctors.html', {
-        'doctors': doctors,
+        'doctors': page.object_list,
+        'page': page,
         'scope_label': 'all hospitals',
         'show_hospital': True,
         'create_url_name': 'accounts:super_admin_create_doctor',
@@ -446,9 +484,16 @@ def super_admin_manage_doctors(request):
 @login_required
 @user_passes_test(is_super_admin)
 def super_admin_manage_patients(request):
-    patients = User.objects.filter(role='patient').select_related('hospital').order_by('-created_at')
+    page = paginate_list(
+        request,
+        User.objects.filter(role='patient').select_related('hospital', 'patient_profile'),
+        USER_LIST_SORTS,
+        filters=_hospital_filter(),
+        search_fields=USER_LIST_SEARCH_FIELDS,
+    )
     return render(request, 'accounts/super_admin_manage_patients.html', {
-        'patients': patients,
+        'patients': page.object_list,
+        'page': page,
         'scope_label': 'all hospitals',
         'show_hospital': True,
         'create_url_name': 'accounts:super_admin_create_patient',
@@ -459,9 +504,16 @@ def super_admin_manage_patients(request):
 @login_required
 @user_passes_test(is_super_admin)
 def super_admin_manage_admins(request):
-    admins = User.objects.filter(role='admin').select_related('hospital').order_by('-created_at')
+    page = paginate_list(
+        request,
+        User.objects.filter(role='admin').select_related('hospital'),
+        USER_LIST_SORTS,
+        filters=_hospital_filter(),
+        search_fields=USER_LIST_SEARCH_FIELDS,
+    )
     return render(request, 'accounts/manage_admins.html', {
-        'admins': admins,
+        'admins': page.object_list,
+        'page': page,
     })
 
 
@@ -522,7 +574,12 @@ def book_appointment(request):
             appointment.requested_by = request.user
             appointment.hospital = hospital
             appointment.status = 'requested'
-            appointment.save()
+            try:
+                reserve_slot(appointment)
+            except SlotUnavailable as exc:
+                # Taken by a concurrent booking after the form was validated.
+                form.add_error('appointment_date', str(exc))
+                return render(request, 'accounts/book_appointment.html', {'form': form})
             
             messages.success(request, f'Appointment requested for {appointment.patient.first_name} {appointment.patient.last_name} with Dr. {appointment.doctor.first_name} {appointment.doctor.last_name}')
             return redirect('accounts:manage_appointments')
@@ -541,12 +598,16 @@ def manage_appointments(request):
         messages.error(request, 'You are not assigned to any hospital. Please contact to super admin.')
         return redirect('accounts:login')
     
-    appointments = Appointment.objects.filter(
-        hospital=hospital,
-        requested_by__isnull=False
-    ).order_by('-created_at')
+    page = paginate_list(
+        request,
+        Appointment.objects.filter(
+            hospital=hospital, requested_by__isnull=False
+        ).select_related('patient', 'doctor'),
+        MANAGE_APPOINTMENT_SORTS,
+        filters={'status': ('Statuses', 'status', Appointment.STATUS_CHOICES)},
+    )
     
-    return render(request, 'accounts/manage_appointments.html', {'appointments': appointments})
+    return render(request, 'accounts/manage_appointments.html', {'appointments': page.object_list, 'page': page})
 
 
 # Doctor Appointment Approval Views
@@ -563,7 +624,7 @@ def pending_appointments(request):
         doctor=request.user,
         appointment_date__gte=timezone.now(),
         status__in=['requested', 'pending_approval']
-    ).order_by('appointment_date')
+    ).select_related('patient').order_by('appointment_date')
     
     return render(request, 'accounts/pending_appointments.html', {'appointments': appointments})
 
@@ -615,11 +676,21 @@ def approve_reject_appointment(request, appointment_id):
                     appointment.appointment_date = new_datetime
                 elif new_date:
                     appointment.appointment_date = new_date
+                if timezone.is_naive(appointment.appointment_date):
+                    appointment.appointment_date = timezone.make_aware(appointment.appointment_date)
                 
                 # Mark that doctor changed the date/time
                 appointment.doctor_change_requested = True
                 appointment.status = 'scheduled'
-                appointment.save()
+                try:
+                    reserve_slot(appointment)
+                except SlotUnavailable as exc:
+                    form.add_error('new_date', str(exc))
+                    appointment.refresh_from_db()
+                    return render(request, 'accounts/approve_reject_appointment.html', {
+                        'appointment': appointment,
+                        'form': form
+                    })
                 
                 # Notify hospital admin about the date/time change
                 if appointment.requested_by:
@@ -701,20 +772,31 @@ def khalti_payment(request):
             messages.error(request, 'Payment initiation failed. Please contact support.')
             return render(request, 'accounts/payment_error.html', {'user': user})
         
-        hospital = patient_profile.hospital
-        appointment_fee = hospital.appointment_fee if hospital else 1000.00
-        amount_in_paisa = int(appointment_fee * 100)
+        # Resume an unfinished payment instead of starting a second one.
+        attempt = open_payment_attempt(user)
+        if attempt is not None:
+            try:
+                attempt = settle_payment_attempt(attempt, get_khalti_client().lookup(attempt.pidx))
+            except KhaltiError:
+                pass
+            if attempt.status == 'completed':
+                return redirect('accounts:payment_success')
+            if attempt.status == 'pending':
+                request.session['khalti_pidx'] = attempt.pidx
+                return redirect(attempt.payment_url)
+        
+        amount_in_paisa = registration_fee_paisa(patient_profile)
         
         # Mark that we're attempting payment
         request.session['payment_init_attempted'] = True
         
         # Initiate payment with Khalti ePayment API
-        url = settings.KHALTI_GATEWAY_URL
+        purchase_order_id = f"PATIENT-{user.id}-{int(timezone.now().timestamp())}"
         payload = {
             "return_url": request.build_absolute_uri(reverse('accounts:khalti_verify')),
             "website_url": request.build_absolute_uri('/'),
             "amount": amount_in_paisa,
-            "purchase_order_id": f"PATIENT-{user.id}-{int(timezone.now().timestamp())}",
+            "purchase_order_id": purchase_order_id,
             "purchase_order_name": "Appointment Fee",
             "customer_info": {
                 "name": f"{user.first_name} {user.last_name}",
@@ -723,17 +805,14 @@ def khalti_payment(request):
             }
         }
         
-        headers = {
-            'Authorization': f'Key {settings.KHALTI_SECRET_KEY}',
-            'Content-Type': 'application/json',
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
-        response_data = response.json()
+        response = get_khalti_client().initiate(payload)
+        response_data = response.data
         
-        if response.status_code == 200 and response_data.get('payment_url'):
+        if response.ok and response_data.get('payment_url'):
             # Clear attempt flag on success
             del request.session['payment_init_attempted']
+            # Record the attempt so it can be reconciled if the callback never comes
+            create_payment_attempt(user, response, amount_in_paisa, purchase_order_id)
             # Store pidx in session for verification
             request.session['khalti_pidx'] = response_data.get('pidx')
             # Redirect to Khalti payment page
@@ -791,27 +870,35 @@ def khalti_verify(request):
             messages.info(request, 'Payment already completed')
             return redirect('accounts:dashboard')
         
-        # Verify payment with Khalti API
-        url = settings.KHALTI_VERIFY_URL
-        headers = {
-            'Authorization': f'Key {settings.KHALTI_SECRET_KEY}',
-            'Content-Type': 'application/json',
-        }
+        # Only payments this patient started can be verified here
+        attempt = PaymentAttempt.objects.filter(patient=user, pidx=pidx).first()
         
-        payload = {"pidx": pidx}
-        response = requests.post(url, json=payload, headers=headers)
-        response_data = response.json()
+        # Verify payment with Khalti API
+        try:
+            if attempt is None:
+                # Payments started before attempts were recorded have no row;
+                # accept them only if Khalti confirms this patient's fee.
+                attempt = record_untracked_payment(
+                    user, pidx, get_khalti_client().lookup(pidx), registration_fee_paisa(patient_profile),
+                )
+                if attempt is None:
+                    messages.error(request, 'Payment verification failed: Unknown transaction')
+                    return redirect('accounts:khalti_payment')
+            else:
+                attempt = settle_payment_attempt(attempt, get_khalti_client().lookup(pidx))
+        except KhaltiError:
+            # The attempt stays pending; reconcile_payments will settle it.
+            return render(request, 'accounts/payment_error.html', {
+                'user': user,
+                'error': 'We could not confirm your payment with Khalti yet. '
+                         'It will be confirmed automatically within a few minutes.',
+            })
         
-        if response.status_code == 200 and response_data.get('status') == 'Completed':
-            # Payment successful
-            patient_profile.payment_status = True
-            patient_profile.khalti_transaction_id = pidx
-            patient_profile.save()
-            
+        if attempt.status == 'completed':
             messages.success(request, 'Payment completed successfully!')
             return redirect('accounts:payment_success')
         else:
-            messages.error(request, f"Payment verification failed: {response_data.get('status', 'Unknown')}")
+            messages.error(request, f"Payment verification failed: {attempt.gateway_status or 'Unknown'}")
             return redirect('accounts:khalti_payment')
             
     except PatientProfile.DoesNotExist:
@@ -0,0 +1,167 @@
+"""
+Appointment access control for the WebSocket consumers.
+
+Every chat, call-invite and video-call socket has to check that its user is
+the appointment's patient or doctor. Reconnect storms (a network blip drops
+every socket at once) used to turn into one database query per reconnect,
+each through the database_sync_to_async thread pool.
+
+The check now reads a small ACL record (appointment id, patient id, doctor
+id, video call room id, status) from two layers:
+
+- a per-process dict with a short TTL, read directly on the event loop, so
+  a reconnect to the same appointment costs no thread hop at all;
+- the shared Django cache, so other workers can skip the database too.
+
+medical.signals drops both layers when an Appointment is saved or deleted.
+Other processes keep their local copy for at most APPOINTMENT_ACL_LOCAL_TTL.
+"""
+
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.core.cache import cache
+
+from .models import Appointment
+
+APPOINTMENT_ACL_TIMEOUT = 300  # seconds, shared cache
+APPOINTMENT_ACL_LOCAL_TTL = 30  # seconds, per-process copy
+APPOINTMENT_ACL_LOCAL_MAX_ENTRIES = 10000
+
+ACL_FIELDS = ('id', 'patient_id', 'doctor_id', 'video_call_room_id', 'status')
+
+
+def appointment_acl_cache_key(appointment_id):
+    return f'appointment_acl:{appointment_id}'
+
+
+def room_acl_cache_key(room_id):
+    return f'appointment_acl_room:{room_id}'
+
+
+def _acl_from_row(row):
+    return {
+        'appointment_id': row['id'],
+        'patient_id': row['patient_id'],
+        'doctor_id': row['doctor_id'],
+        'room_id': row['video_call_room_id'],
+        'status': row['status'],
+    }
+
+
+def can_access(acl, user):
+    """True when the user is the appointment's patient or doctor."""
+    return acl is not None and user.id in (acl['patient_id'], acl['doctor_id'])
+
+
+class LocalACLCache:
+    """Process-local TTL map; expired entries are evicted when read or when full."""
+
+    def __init__(self, ttl=APPOINTMENT_ACL_LOCAL_TTL, max_entries=APPOINTMENT_ACL_LOCAL_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        # Signal handlers invalidate from request threads.
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+                if len(self.entries) >= self.max_entries:
+                    self.entries.clear()
+            self.entries[key] = (now + self.ttl, value)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_acls = LocalACLCache()
+
+
+def _remember(acl):
+    local_acls.set(appointment_acl_cache_key(acl['appointment_id']), acl)
+    values = {appointment_acl_cache_key(acl['appointment_id']): acl}
+    if acl['room_id']:
+        local_acls.set(room_acl_cache_key(acl['room_id']), acl['appointment_id'])
+        values[room_acl_cache_key(acl['room_id'])] = acl['appointment_id']
+    cache.set_many(values, APPOINTMENT_ACL_TIMEOUT)
+
+
+def get_appointment_acl(appointment_id):
+    """The ACL record for an appointment, or None if it does not exist."""
+    key = appointment_acl_cache_key(appointment_id)
+    acl = local_acls.get(key)
+    if acl is not None:
+        return acl
+    acl = cache.get(key)
+    if acl is None:
+        row = Appointment.objects.filter(id=appointment_id).values(*ACL_FIELDS).first()
+        if row is None:
+            return None
+        acl = _acl_from_row(row)
+        _remember(acl)
+    else:
+        local_acls.set(key, acl)
+    return acl
+
+
+def get_room_acl(room_id):
+    """The ACL record of the appointment that owns a video call room, or None."""
+    key = room_acl_cache_key(room_id)
+    appointment_id = local_acls.get(key) or cache.get(key)
+    if appointment_id is not None:
+        acl = get_appointment_acl(appointment_id)
+        # The appointment may have moved to a new room since.
+        if acl is not None and acl['room_id'] == room_id:
+            return acl
+    row = Appointment.objects.filter(video_call_room_id=room_id).values(*ACL_FIELDS).first()
+    if row is None:
+        return None
+    acl = _acl_from_row(row)
+    _remember(acl)
+    return acl
+
+
+async def aget_appointment_acl(appointment_id):
+    """get_appointment_acl() for consumers; only misses leave the event loop."""
+    acl = local_acls.get(appointment_acl_cache_key(appointment_id))
+    if acl is not None:
+        return acl
+    return await database_sync_to_async(get_appointment_acl)(appointment_id)
+
+
+async def aget_room_acl(room_id):
+    appointment_id = local_acls.get(room_acl_cache_key(room_id))
+    if appointment_id is not None:
+        acl = local_acls.get(appointment_acl_cache_key(appointment_id))
+        if acl is not None and acl['room_id'] == room_id:
+            return acl
+    return await database_sync_to_async(get_room_acl)(room_id)
+
+
+def invalidate_appointment_acl(appointment_id, room_id=None):
+    keys = [appointment_acl_cache_key(appointment_id)]
+    if room_id:
+        keys.append(room_acl_cache_key(room_id))
+    local_acls.delete(*keys)
+    cache.delete_many(keys)
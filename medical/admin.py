@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Hospital, DoctorProfile, PatientProfile, Appointment, Availability, Notification
+from .models import Hospital, DoctorProfile, PatientProfile, Appointment, Availability, Notification, PaymentAttempt
 
 
 @admin.register(Hospital)
@@ -51,3 +51,13 @@ class NotificationAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
     date_hierarchy = 'created_at'
     ordering = ('-created_at',)
+
+
+@admin.register(PaymentAttempt)
+class PaymentAttemptAdmin(admin.ModelAdmin):
+    list_display = ('pidx', 'patient', 'amount', 'status', 'gateway_status', 'check_count', 'created_at', 'settled_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('pidx', 'purchase_order_id', 'transaction_id', 'patient__first_name', 'patient__last_name')
+    readonly_fields = ('created_at', 'updated_at', 'last_checked_at', 'settled_at')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
@@ -0,0 +1,246 @@
+"""
+Chat attachment storage pipeline.
+
+- Uploads: ChatAttachmentUploadHandler streams the request body to a
+  temporary file in 64 KB chunks and stops reading as soon as the file grows
+  past MAX_CHAT_ATTACHMENT_SIZE, so an attachment is never held in memory
+  and an oversized one is rejected without being written out in full.
+- Metadata: describe_attachment() records size, MIME type (sniffed from the
+  leading bytes, not taken from the client) and image dimensions once, at
+  upload time, on the ChatMessage row.
+- Thumbnails: schedule_thumbnail() hands raster images to a small per-process
+  thread pool after the message is committed; the upload request does not
+  wait for Pillow.
+- Downloads: attachment_response() serves a stored file with an ETag,
+  answers If-None-Match with 304 and a single-range ``Range`` header with
+  206, so previews and resumed downloads only transfer what they need.
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import connections, transaction
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, parse_etags
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MAX_CHAT_ATTACHMENT_SIZE = 10 * 1024 * 1024  # 10 MB
+THUMBNAIL_SIZE = (320, 320)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_CACHE_CONTROL = 'private, max-age=86400'
+
+# Leading bytes of the formats we treat specially. Images are only shown
+# inline when their content really is one of these raster formats.
+FILE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'%PDF-', 'application/pdf'),
+]
+RASTER_IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp'}
+
+
+class ChatAttachmentUploadHandler(TemporaryFileUploadHandler):
+    """Stream file uploads to disk, giving up once one exceeds ``max_size``."""
+
+    def __init__(self, request=None, max_size=MAX_CHAT_ATTACHMENT_SIZE):
+        super().__init__(request)
+        self.max_size = max_size
+        self.received = 0
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.too_large = True
+            self.file.close()
+            # Drain the rest of the body so the client still gets our 400.
+            raise StopUpload(connection_reset=False)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def sniff_content_type(header, name=''):
+    for signature, content_type in FILE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    guessed = mimetypes.guess_type(name)[0]
+    # Never label unknown content as an image on the strength of its name.
+    if guessed and not guessed.startswith('image/'):
+        return guessed
+    return 'application/octet-stream'
+
+
+def describe_attachment(upload):
+    """Return size, content_type, width and height for an uploaded file."""
+    upload.seek(0)
+    header = upload.read(16)
+    upload.seek(0)
+    metadata = {
+        'attachment_size': upload.size,
+        'content_type': sniff_content_type(header, upload.name),
+        'attachment_width': None,
+        'attachment_height': None,
+    }
+    if metadata['content_type'] in RASTER_IMAGE_TYPES:
+        try:
+            # Only the header is parsed here; pixel data is not decoded.
+            with Image.open(upload) as image:
+                metadata['attachment_width'], metadata['attachment_height'] = image.size
+        except (OSError, Image.DecompressionBombError):
+            metadata['content_type'] = 'application/octet-stream'
+        upload.seek(0)
+    return metadata
+
+
+def is_raster_image(content_type):
+    return content_type in RASTER_IMAGE_TYPES
+
+
+_executor = None
+
+
+def get_thumbnail_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'CHAT_THUMBNAIL_WORKERS', 2),
+            thread_name_prefix='chat-thumbnail',
+        )
+    return _executor
+
+
+def generate_thumbnail(message_id):
+    """Write a THUMBNAIL_SIZE preview for an image message; returns its storage name."""
+    from .models import ChatMessage
+
+    message = ChatMessage.objects.filter(pk=message_id).first()
+    if message is None or not message.attachment or message.attachment_thumbnail \
+            or not is_raster_image(message.content_type):
+        return None
+
+    with message.attachment.open('rb') as source, Image.open(source) as image:
+        image.thumbnail(THUMBNAIL_SIZE)
+        keeps_alpha = image.mode in ('RGBA', 'LA', 'P')
+        output = BytesIO()
+        if keeps_alpha:
+            image.save(output, format='PNG', optimize=True)
+        else:
+            image.convert('RGB').save(output, format='JPEG', quality=80, optimize=True)
+
+    stem = os.path.splitext(os.path.basename(message.attachment.name))[0]
+    extension = 'png' if keeps_alpha else 'jpg'
+    message.attachment_thumbnail.save(f'{stem}_thumb.{extension}', ContentFile(output.getvalue()), save=False)
+    ChatMessage.objects.filter(pk=message_id).update(attachment_thumbnail=message.attachment_thumbnail.name)
+    return message.attachment_thumbnail.name
+
+
+def _thumbnail_job(message_id):
+    try:
+        generate_thumbnail(message_id)
+    except Exception:
+        logger.exception('Could not generate a thumbnail for chat message %s', message_id)
+    finally:
+        # Worker threads outlive requests; do not leak their DB connections.
+        connections.close_all()
+
+
+def schedule_thumbnail(message):
+    """Queue thumbnail generation once the message's transaction commits."""
+    if message.attachment and is_raster_image(message.content_type):
+        transaction.on_commit(lambda: get_thumbnail_executor().submit(_thumbnail_job, message.pk))
+
+
+def attachment_etag(name, size):
+    # Stored attachments never change in place, so name and size identify
+    # the content without reading it.
+    return '"%s"' % hashlib.md5(f'{name}:{size}'.encode()).hexdigest()
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``bytes=`` range into (start, end) inclusive. Returns None
+    when the header should be ignored (absent, malformed or multi-range) and
+    raises ValueError when it cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError('Unsatisfiable range')
+    return start, min(end, size - 1)
+
+
+def _iter_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def attachment_response(request, field_file, size, content_type, filename, inline):
+    """Serve a stored file with ETag revalidation and single-range requests."""
+    etag = attachment_etag(field_file.name, size)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = ATTACHMENT_CACHE_CONTROL
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if not if_range or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = field_file.storage.open(field_file.name, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_range(file, start, end - start + 1), status=206,
+                                         content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = ATTACHMENT_CACHE_CONTROL
+    response['Content-Disposition'] = content_disposition_header(not inline, filename)
+    return response
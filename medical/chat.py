@@ -0,0 +1,59 @@
+"""
+Chat message payloads shared by the HTTP views and the chat socket.
+"""
+
+from django.urls import reverse
+from django.utils import timezone
+
+
+# Columns serialize_chat_message needs; fetch history with .values(*CHAT_MESSAGE_FIELDS).
+CHAT_MESSAGE_FIELDS = (
+    'id', 'message', 'created_at', 'sender_id', 'sender__first_name', 'sender__last_name',
+    'attachment', 'attachment_name', 'attachment_size', 'is_image', 'attachment_thumbnail',
+)
+
+
+def chat_message_row(message, sender=None):
+    """
+    The CHAT_MESSAGE_FIELDS row for a ChatMessage instance already in memory.
+    Pass ``sender`` when the message's sender is not loaded.
+    """
+    sender = sender or message.sender
+    return {
+        'id': message.id,
+        'message': message.message,
+        'created_at': message.created_at,
+        'sender_id': message.sender_id,
+        'sender__first_name': sender.first_name,
+        'sender__last_name': sender.last_name,
+        'attachment': message.attachment.name,
+        'attachment_name': message.attachment_name,
+        'attachment_size': message.attachment_size,
+        'is_image': message.is_image,
+        'attachment_thumbnail': message.attachment_thumbnail.name,
+    }
+
+
+def serialize_chat_message(row, current_user):
+    """Build the client payload from a CHAT_MESSAGE_FIELDS row, without touching storage."""
+    local_timestamp = timezone.localtime(row['created_at'])
+    has_attachment = bool(row['attachment'])
+
+    return {
+        'id': row['id'],
+        'message_id': row['id'],
+        'message': row['message'],
+        'sender': f"{row['sender__first_name']} {row['sender__last_name']}",
+        'sender_id': row['sender_id'],
+        'created_at': local_timestamp.isoformat(),
+        'created_at_display': local_timestamp.strftime('%I:%M %p').lstrip('0'),
+        'is_self': row['sender_id'] == current_user.id,
+        'has_attachment': has_attachment,
+        'attachment_url': reverse('medical:chat_attachment', args=[row['id']]) if has_attachment else None,
+        'attachment_name': (row['attachment_name'] or 'Attachment') if has_attachment else None,
+        'attachment_size': row['attachment_size'],
+        'is_image': row['is_image'],
+        'thumbnail_url': (
+            reverse('medical:chat_attachment_thumbnail', args=[row['id']]) if row['attachment_thumbnail'] else None
+        ),
+    }
@@ -0,0 +1,324 @@
+"""
+Write-behind persistence for chat socket messages (settings.CHAT_WRITE_BEHIND).
+
+By default ChatConsumer saves each message with its own INSERT and commit
+before broadcasting it. In write-behind mode a per-process ChatWriteBehind
+takes over:
+
+1. The message gets its primary key from the ChatMessage id sequence
+   (reserve_message_ids), so clients see the final id straight away.
+2. It is appended to a local journal file and then broadcast.
+3. Pending messages are written with one bulk_create every
+   CHAT_WRITE_BEHIND_FLUSH_INTERVAL seconds, or as soon as
+   CHAT_WRITE_BEHIND_BATCH_SIZE of them are waiting. A flush that fails
+   with OperationalError keeps them queued and retries. A message that can
+   never be stored, such as one whose appointment was deleted while it
+   waited, is logged as a dead letter and dropped so it cannot block the
+   rest.
+
+Delivery is at-least-once: a message is journaled before anyone can see it,
+and the journal is only emptied once everything in it has been written. If
+the process dies, the next writer to start (on any worker sharing the
+journal directory) replays the journals nobody holds a lock on. Replays are
+harmless because ids are fixed up front and inserts ignore conflicts.
+
+Being durable is not the same as being readable yet: a broadcast message is
+only in the database after its flush. Socket resumes merge in the messages
+this process's writer still holds (ChatWriteBehind.unsaved), but an HTTP
+``after_id`` poll, or a resume served by another worker, can move a client's
+cursor past a message that is still queued elsewhere. That client then only
+sees it after a full reload.
+
+Ids are reserved CHAT_WRITE_BEHIND_ID_BLOCK at a time. Blocks larger than 1
+save round trips, but ids are then only in send order within one process;
+keep it at 1 when several WebSocket workers serve the same rooms, since
+clients resume from the highest id they have seen.
+"""
+
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import uuid
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 0.01  # seconds
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_ID_BLOCK = 1
+RETRY_DELAY = 1  # seconds
+
+
+class IdReservationNotSupported(Exception):
+    """The database backend has no sequence write-behind can draw ids from."""
+
+
+def reserve_message_ids(count):
+    """Take ``count`` ids from ChatMessage's primary key sequence."""
+    using = router.db_for_write(ChatMessage)
+    connection = connections[using]
+    table = ChatMessage._meta.db_table
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [table, count],
+            )
+            return [row[0] for row in cursor.fetchall()]
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT tables never reuse an id at or below sqlite_sequence.seq,
+            # so bumping it reserves the block for us.
+            quoted = connection.ops.quote_name(table)
+            cursor.execute(
+                f'UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX(id), 0) FROM {quoted})) + %s '
+                f'WHERE name = %s',
+                [count, table],
+            )
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    f'INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX(id), 0) + %s FROM {quoted}',
+                    [table, count],
+                )
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            last = cursor.fetchone()[0]
+            return list(range(last - count + 1, last + 1))
+    raise IdReservationNotSupported(f'Cannot reserve ChatMessage ids on {connection.vendor}')
+
+
+def _record(message):
+    return {
+        'id': message.id,
+        'appointment_id': message.appointment_id,
+        'sender_id': message.sender_id,
+        'message': message.message,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def _message(record):
+    return ChatMessage(
+        id=record['id'],
+        appointment_id=record['appointment_id'],
+        sender_id=record['sender_id'],
+        message=record['message'],
+        created_at=parse_datetime(record['created_at']),
+    )
+
+
+def write_messages(messages):
+    """
+    Insert ``messages``, skipping ones already stored. A batch that breaks a
+    constraint is split until the offending messages are isolated; those are
+    logged and dropped. Returns the number of messages dropped.
+    """
+    try:
+        with transaction.atomic(using=router.db_for_write(ChatMessage)):
+            ChatMessage.objects.bulk_create(messages, ignore_conflicts=True)
+    except IntegrityError:
+        if len(messages) == 1:
+            logger.error('Dropping chat message that cannot be stored: %s', json.dumps(_record(messages[0])))
+            return 1
+        middle = len(messages) // 2
+        return write_messages(messages[:middle]) + write_messages(messages[middle:])
+    return 0
+
+
+class MessageJournal:
+    """Append-only JSON-lines file, locked for as long as its writer lives."""
+
+    def __init__(self, directory, fsync=False):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'chat-{os.getpid()}-{uuid.uuid4().hex}.jsonl')
+        self.fsync = fsync
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, record):
+        os.write(self.fd, (json.dumps(record) + '\n').encode())
+        if self.fsync:
+            os.fsync(self.fd)
+
+    def truncate(self):
+        os.ftruncate(self.fd, 0)
+
+    def close(self, remove=True):
+        if remove:
+            os.unlink(self.path)
+        os.close(self.fd)
+
+
+def recover_journals(directory, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write the messages of every journal in ``directory`` whose writer is gone,
+    then delete those journals. Returns the number of journaled messages.
+    """
+    recovered = 0
+    for path in sorted(glob.glob(os.path.join(directory, 'chat-*.jsonl'))):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # A live writer owns it.
+            with open(fd, closefd=False) as journal:
+                lines = [line for line in journal.read().splitlines() if line.strip()]
+            messages = []
+            for line in lines:
+                try:
+                    messages.append(_message(json.loads(line)))
+                except (ValueError, KeyError):
+                    # A torn last line from the crash; it was never broadcast.
+                    logger.warning('Skipping unreadable chat journal line in %s', path)
+            for start in range(0, len(messages), batch_size):
+                write_messages(messages[start:start + batch_size])
+            recovered += len(messages)
+            os.unlink(path)
+        finally:
+            os.close(fd)
+    if recovered:
+        logger.warning('Recovered %s chat message(s) from write-behind journals', recovered)
+    return recovered
+
+
+class ChatWriteBehind:
+    def __init__(self, journal_dir, flush_interval=DEFAULT_FLUSH_INTERVAL, batch_size=DEFAULT_BATCH_SIZE,
+                 id_block=DEFAULT_ID_BLOCK, fsync=False):
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.id_block = id_block
+        self.fsync = fsync
+        self.journal = None
+        self.ids = []
+        self.pending = []
+        self.writing = []
+        self.flush_task = None
+        # The loop only keeps weak references to tasks; hold the batch
+        # flushes started by add() until they finish.
+        self.batch_flushes = set()
+        self.id_lock = asyncio.Lock()
+        self.flush_lock = asyncio.Lock()
+        self.start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.start_lock:
+            if self.journal is None:
+                try:
+                    await database_sync_to_async(recover_journals)(self.journal_dir, self.batch_size)
+                except Exception:
+                    # Unrecovered journals stay unlocked on disk for the next
+                    # writer; new messages must not wait on them.
+                    logger.exception('Could not recover chat write-behind journals')
+                self.journal = MessageJournal(self.journal_dir, fsync=self.fsync)
+
+    async def next_id(self):
+        async with self.id_lock:
+            if not self.ids:
+                self.ids = await database_sync_to_async(reserve_message_ids)(self.id_block)
+            return self.ids.pop(0)
+
+    async def add(self, appointment_id, sender_id, message_text):
+        """Queue a message and return it, unsaved but with its final id."""
+        if self.journal is None:
+            await self.start()
+        message = ChatMessage(
+            id=await self.next_id(),
+            appointment_id=appointment_id,
+            sender_id=sender_id,
+            message=message_text,
+            created_at=timezone.now(),
+        )
+        self.journal.append(_record(message))
+        self.pending.append(message)
+        if len(self.pending) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self.batch_flushes.add(task)
+            task.add_done_callback(self.batch_flushes.discard)
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later(self.flush_interval))
+        return message
+
+    def unsaved(self, appointment_id, after_id):
+        """Messages of an appointment newer than ``after_id`` that may not be in the database yet."""
+        return [
+            message for message in self.writing + self.pending
+            if message.appointment_id == appointment_id and message.id > after_id
+        ]
+
+    async def flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            self.writing = batch
+            try:
+                await database_sync_to_async(write_messages)(batch)
+            except OperationalError:
+                logger.exception('Could not write %s chat message(s); retrying', len(batch))
+                self.pending[:0] = batch
+                if self.flush_task is None:
+                    self.flush_task = asyncio.create_task(self.flush_later(RETRY_DELAY))
+                return
+            except Exception:
+                # Retrying cannot fix these; keep the journal moving.
+                logger.exception(
+                    'Dropping %s chat message(s) that could not be written: %s',
+                    len(batch), json.dumps([_record(message) for message in batch]),
+                )
+            finally:
+                self.writing = []
+            if not self.pending:
+                # Everything journaled so far is in the database.
+                self.journal.truncate()
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.batch_flushes:
+            await asyncio.gather(*self.batch_flushes)
+        await self.flush()
+        if self.journal is not None:
+            self.journal.close(remove=not self.pending)
+            self.journal = None
+
+
+# One writer per event loop: its locks and timers belong to that loop.
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_chat_writer():
+    """The process's writer, or None when write-behind is disabled."""
+    if not getattr(settings, 'CHAT_WRITE_BEHIND', False):
+        return None
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = ChatWriteBehind(
+            journal_dir=settings.CHAT_WRITE_BEHIND_JOURNAL_DIR,
+            flush_interval=getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+            batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            id_block=getattr(settings, 'CHAT_WRITE_BEHIND_ID_BLOCK', DEFAULT_ID_BLOCK),
+            fsync=getattr(settings, 'CHAT_WRITE_BEHIND_FSYNC', False),
+        )
+        _writers[loop] = writer
+    return writer
@@ -1,21 +1,115 @@
 import asyncio
 import json
+import logging
+import time
 import uuid
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.utils import timezone
 
-from .models import Appointment, ChatMessage
+from .acl import aget_appointment_acl, aget_room_acl, can_access
+from .chat import CHAT_MESSAGE_FIELDS, chat_message_row, serialize_chat_message
+from .chat_writer import get_chat_writer
+from .models import ChatMessage
+from .notifications import get_unread_notification_count, user_notifications_group
+from .presence import get_presence_backend
+from .read_cursors import get_read_cursor_buffer
+
+CHAT_RESUME_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+# Signaling frame types that arrive in bursts; only one in
+# SIGNALING_LOG_SAMPLE_RATE of them is logged at DEBUG level.
+HIGH_FREQUENCY_SIGNALING_TYPES = {'ice-candidate', 'ice-candidates'}
+SIGNALING_LOG_SAMPLE_RATE = 50
+SIGNALING_FRAME_TYPES = {
+    'offer', 'answer', 'ice-candidate', 'ice-candidates', 'join', 'leave', 'call-ended', 'chat',
+    'screen-share',
+}
+MAX_ICE_BATCH_SIZE = 50
+
+
+def chat_message_event(message):
+    """chat_message group event fields for a text-only message."""
+    local_timestamp = timezone.localtime(message.created_at)
+    return {
+        'id': message.id,
+        'message': message.message,
+        'sender_id': message.sender_id,
+        'created_at': local_timestamp.isoformat(),
+        'created_at_display': local_timestamp.strftime('%I:%M %p').lstrip('0'),
+        'has_attachment': False,
+        'attachment_url': None,
+        'attachment_name': None,
+        'attachment_size': 0,
+        'is_image': False,
+        'thumbnail_url': None,
+    }
 
 
 class VideoCallConsumer(AsyncWebsocketConsumer):
+    # Per-process signaling metrics: frames received per room and type, and
+    # open sockets per room (a room's counters are dropped when it empties).
+    frame_counts = defaultdict(Counter)
+    frame_totals = Counter()
+    room_sockets = Counter()
+
+    @classmethod
+    def get_frame_counts(cls):
+        return {
+            'totals': dict(cls.frame_totals),
+            'rooms': {room_id: dict(counts) for room_id, counts in cls.frame_counts.items()},
+        }
+
+    def record_frame(self, message_type):
+        if message_type not in SIGNALING_FRAME_TYPES:
+            message_type = 'other'
+        room_counts = self.frame_counts[self.room_id]
+        room_counts[message_type] += 1
+        self.frame_totals[message_type] += 1
+
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        count = room_counts[message_type]
+        if message_type in HIGH_FREQUENCY_SIGNALING_TYPES and count % SIGNALING_LOG_SAMPLE_RATE != 1:
+            return
+        logger.debug(
+            'video call frame room=%s type=%s count=%d channel=%s',
+            self.room_id, message_type, count, self.channel_name,
+        )
+
     async def connect(self):
+        user = self.scope.get('user')
+        if not user or user.is_anonymous:
+            await self.close(code=4001)
+            return
+
         self.room_id = self.scope['url_route']['kwargs']['room_id']
+        acl = await aget_room_acl(self.room_id)
+        if acl is None:
+            await self.close(code=4004)
+            return
+
+        if not can_access(acl, user):
+            await self.close(code=4003)
+            return
+
+        self.user = user
         self.room_group_name = f'video_call_{self.room_id}'
         self.peer_id = str(uuid.uuid4())
         self.user_type = None  # Will be set when user sends join message
+        # Other joined sockets in the room: channel_name -> peer_id/user_type.
+        # Built from peer_joined broadcasts and the peer_announce replies.
+        self.peers = {}
+        # Whether this client accepts 'ice-candidates' batches (sent with join).
+        self.batch_ice = False
+        self.pending_ice_candidates = []
+        self.ice_flush_task = None
         
         # Join room group
         await self.channel_layer.group_add(
@@ -24,11 +118,22 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        self.room_sockets[self.room_id] += 1
         
         # Don't send peer_joined here - wait for user to send join message
         # This ensures we know their user_type before notifying others
     
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            return
+
+        await self.flush_ice_candidates()
+
+        self.room_sockets[self.room_id] -= 1
+        if self.room_sockets[self.room_id] <= 0:
+            self.room_sockets.pop(self.room_id, None)
+            self.frame_counts.pop(self.room_id, None)
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -40,59 +145,89 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 'type': 'peer_left',
+                'sender': self.channel_name,
                 'message': 'A peer has left the room'
             }
         )
+
+    def get_target_channels(self, target=None):
+        """Channels that should receive a signaling frame from this peer."""
+        if target:
+            return [
+                channel for channel, peer in self.peers.items()
+                if target in (peer['peer_id'], peer['user_type'])
+            ]
+        # 1:1 calls: the participant on the other side; otherwise everyone else.
+        others = [
+            channel for channel, peer in self.peers.items()
+            if peer['user_type'] != self.user_type
+        ]
+        return others or list(self.peers)
+
+    async def send_to_peers(self, event, target=None):
+        channels = self.get_target_channels(target)
+        if not channels:
+            # Roster not known yet (nobody else has joined); fall back to the group.
+            await self.channel_layer.group_send(self.room_group_name, event)
+            return
+
+        for channel in channels:
+            await self.channel_layer.send(channel, event)
     
     async def receive(self, text_data):
-        print(f"[VideoCall] Received message in room {self.room_id}: {text_data}")
-        data = json.loads(text_data)
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            logger.warning('video call: invalid JSON frame in room %s', self.room_id)
+            return
         message_type = data.get('type')
-        print(f"[VideoCall] Message type: {message_type}, from channel: {self.channel_name}")
+        self.record_frame(message_type)
         
         if message_type == 'offer':
-            # Broadcast offer to all other peers in the room
-            await self.channel_layer.group_send(
-                self.room_group_name,
+            # Deliver offer directly to the other peer(s)
+            await self.send_to_peers(
                 {
                     'type': 'webrtc_offer',
                     'offer': data.get('offer'),
                     'sender': self.channel_name,
-                }
+                },
+                data.get('target'),
             )
         
         elif message_type == 'answer':
-            # Broadcast answer to all other peers in the room
-            await self.channel_layer.group_send(
-                self.room_group_name,
+            # Deliver answer directly to the other peer(s)
+            await self.send_to_peers(
                 {
                     'type': 'webrtc_answer',
                     'answer': data.get('answer'),
                     'sender': self.channel_name,
-                }
+                },
+                data.get('target'),
             )
         
         elif message_type == 'ice-candidate':
-            # Broadcast ICE candidate to all other peers
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'webrtc_ice_candidate',
-                    'candidate': data.get('candidate'),
-                    'sender': self.channel_name,
-                }
-            )
+            # Deliver ICE candidate directly to the other peer(s), coalesced
+            # with others arriving within the batch window
+            await self.queue_ice_candidates([data.get('candidate')], data.get('target'))
+        
+        elif message_type == 'ice-candidates':
+            candidates = data.get('candidates')
+            if isinstance(candidates, list) and candidates:
+                await self.queue_ice_candidates(candidates[:MAX_ICE_BATCH_SIZE], data.get('target'))
         
         elif message_type == 'join':
             # Store user type
             self.user_type = data.get('user_type')
+            self.batch_ice = bool(data.get('batch_ice'))
             
-            # Send peer_joined first (generic notification)
+            # Send peer_joined first (generic notification); peers reply
+            # with peer_announce so this socket learns the roster.
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'peer_joined',
                     'peer_id': self.peer_id,
+                    'user_type': self.user_type,
                     'sender': self.channel_name,
                     'message': 'A new peer has joined the room'
                 }
@@ -156,17 +291,53 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
                 }
             )
     
+    async def queue_ice_candidates(self, candidates, target=None):
+        window = settings.VIDEO_CALL_ICE_BATCH_WINDOW
+        if target or window <= 0:
+            await self.send_ice_candidates(candidates, target)
+            return
+
+        self.pending_ice_candidates.extend(candidates)
+        if len(self.pending_ice_candidates) >= MAX_ICE_BATCH_SIZE:
+            await self.flush_ice_candidates()
+        elif self.ice_flush_task is None:
+            self.ice_flush_task = asyncio.create_task(self.flush_ice_candidates_later(window))
+
+    async def flush_ice_candidates_later(self, delay):
+        await asyncio.sleep(delay)
+        self.ice_flush_task = None
+        await self.flush_ice_candidates()
+
+    async def flush_ice_candidates(self):
+        task = getattr(self, 'ice_flush_task', None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            self.ice_flush_task = None
+
+        candidates = getattr(self, 'pending_ice_candidates', None)
+        if not candidates:
+            return
+        self.pending_ice_candidates = []
+        await self.send_ice_candidates(candidates)
+
+    async def send_ice_candidates(self, candidates, target=None):
+        await self.send_to_peers(
+            {
+                'type': 'webrtc_ice_candidates',
+                'candidates': candidates,
+                'sender': self.channel_name,
+            },
+            target,
+        )
+
     # Handler methods for different message types
     async def webrtc_offer(self, event):
         # Don't send back to the sender
         if event['sender'] != self.channel_name:
-            print(f"[VideoCall] Sending offer to {self.channel_name}")
             await self.send(text_data=json.dumps({
                 'type': 'offer',
                 'offer': event['offer'],
             }))
-        else:
-            print(f"[VideoCall] Skipping offer for sender {self.channel_name}")
     
     async def webrtc_answer(self, event):
         # Don't send back to the sender
@@ -184,19 +355,55 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
                 'candidate': event['candidate'],
             }))
     
+    async def webrtc_ice_candidates(self, event):
+        # Don't send back to the sender
+        if event['sender'] == self.channel_name:
+            return
+
+        if self.batch_ice:
+            await self.send(text_data=json.dumps({
+                'type': 'ice-candidates',
+                'candidates': event['candidates'],
+            }))
+            return
+
+        for candidate in event['candidates']:
+            await self.send(text_data=json.dumps({
+                'type': 'ice-candidate',
+                'candidate': candidate,
+            }))
+    
     async def peer_joined(self, event):
         # Don't send back to the sender
-        if event.get('sender') != self.channel_name:
-            print(f"[VideoCall] Sending peer_joined to {self.channel_name}")
+        sender = event.get('sender')
+        if sender != self.channel_name:
+            self.peers[sender] = {
+                'peer_id': event.get('peer_id'),
+                'user_type': event.get('user_type'),
+            }
+            if self.user_type is not None:
+                await self.channel_layer.send(sender, {
+                    'type': 'peer_announce',
+                    'peer_id': self.peer_id,
+                    'user_type': self.user_type,
+                    'sender': self.channel_name,
+                })
+
             await self.send(text_data=json.dumps({
                 'type': 'peer-joined',
                 'peer_id': event.get('peer_id'),
                 'message': event.get('message'),
             }))
-        else:
-            print(f"[VideoCall] Skipping peer_joined for sender {self.channel_name}")
+    
+    async def peer_announce(self, event):
+        # Direct reply from a peer that was already in the room.
+        self.peers[event['sender']] = {
+            'peer_id': event.get('peer_id'),
+            'user_type': event.get('user_type'),
+        }
     
     async def peer_left(self, event):
+        self.peers.pop(event.get('sender'), None)
         await self.send(text_data=json.dumps({
             'type': 'peer-left',
             'message': event.get('message'),
@@ -205,14 +412,11 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
     async def user_joined(self, event):
         # Don't send back to the sender
         if event.get('sender') != self.channel_name:
-            print(f"[VideoCall] Sending user_joined ({event.get('user_type')}) to {self.channel_name}")
             await self.send(text_data=json.dumps({
                 'type': 'user-joined',
                 'user_type': event.get('user_type'),
                 'user_name': event.get('user_name'),
             }))
-        else:
-            print(f"[VideoCall] Skipping user_joined for sender {self.channel_name}")
     
     async def user_left(self, event):
         # Don't send back to the sender
@@ -257,21 +461,21 @@ class CallInviteConsumer(AsyncWebsocketConsumer):
 
         self.user = user
         self.appointment_id = int(self.scope['url_route']['kwargs']['appointment_id'])
-        self.room_group_name = f'call_invite_{self.appointment_id}'
 
-        appointment = await self.get_appointment(self.appointment_id)
-        if not appointment:
+        acl = await aget_appointment_acl(self.appointment_id)
+        if acl is None:
             await self.close(code=4004)
             return
 
-        if self.user.id not in {appointment.patient_id, appointment.doctor_id}:
+        if not can_access(acl, self.user):
             await self.close(code=4003)
             return
 
-        self.appointment = appointment
-        self.is_doctor = self.user.id == appointment.doctor_id
-        self.is_patient = self.user.id == appointment.patient_id
+        self.acl = acl
+        self.is_doctor = self.user.id == acl['doctor_id']
+        self.is_patient = self.user.id == acl['patient_id']
 
+        self.room_group_name = f'call_invite_{self.appointment_id}'
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
@@ -305,7 +509,7 @@ class CallInviteConsumer(AsyncWebsocketConsumer):
         if message_type in {'call_accepted', 'call_declined'} and not self.is_patient:
             return
 
-        room_id = data.get('room_id') or self.appointment.video_call_room_id
+        room_id = data.get('room_id') or self.acl['room_id']
         payload = {
             'type': message_type,
             'appointment_id': self.appointment_id,
@@ -335,21 +539,8 @@ class CallInviteConsumer(AsyncWebsocketConsumer):
         full_name = f'{self.user.first_name} {self.user.last_name}'.strip()
         return full_name or self.user.username or self.user.email
 
-    @database_sync_to_async
-    def get_appointment(self, appointment_id):
-        return Appointment.objects.filter(id=appointment_id).first()
-
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    room_connections = defaultdict(lambda: defaultdict(set))
-    presence_lock = None
-
-    @classmethod
-    def get_presence_lock(cls):
-        if cls.presence_lock is None:
-            cls.presence_lock = asyncio.Lock()
-        return cls.presence_lock
-
     async def connect(self):
         user = self.scope.get('user')
         if not user or user.is_anonymous:
@@ -358,21 +549,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         self.user = user
         self.appointment_id = int(self.scope['url_route']['kwargs']['appointment_id'])
-        self.room_group_name = f'chat_{self.appointment_id}'
 
-        appointment = await self.get_appointment(self.appointment_id)
-        if not appointment:
+        acl = await aget_appointment_acl(self.appointment_id)
+        if acl is None:
             await self.close(code=4004)
             return
 
-        if self.user.id not in {appointment.patient_id, appointment.doctor_id}:
+        if not can_access(acl, self.user):
             await self.close(code=4003)
             return
 
+        self.room_group_name = f'chat_{self.appointment_id}'
+        # Newest message id this socket knows the client has, and the read
+        # cursor it last reported; read frames are capped by the former.
+        self.latest_message_id = 0
+        self.last_read_id = 0
+        # Typing state last broadcast for this socket, the state the client
+        # asked for since, and the throttle and expiry timers.
+        self.typing = False
+        self.typing_wanted = False
+        self.typing_sent_at = 0
+        self.typing_task = None
+        self.typing_expiry_task = None
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
-        online_user_ids = await self.add_online_user()
+        self.presence = get_presence_backend()
+        online_user_ids = await self.presence.add(self.room_group_name, self.user.id, self.channel_name)
+        self.heartbeat_task = asyncio.create_task(self.presence_heartbeat())
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -382,10 +586,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
-        if not hasattr(self, 'room_group_name'):
+        if not hasattr(self, 'heartbeat_task'):
             return
 
-        online_user_ids = await self.remove_online_user()
+        self.heartbeat_task.cancel()
+        self.cancel_typing_timers()
+        if self.typing:
+            self.typing_wanted = False
+            await self.broadcast_typing()
+        if self.last_read_id:
+            # Do not leave this user's cursor waiting on the batch timer.
+            await get_read_cursor_buffer().flush()
+        online_user_ids = await self.presence.remove(self.room_group_name, self.user.id, self.channel_name)
 
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
         await self.channel_layer.group_send(
@@ -414,11 +626,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if not message_text:
                 return
 
-            message_data = await self.save_message(
-                appointment_id=self.appointment_id,
-                sender_id=self.user.id,
-                message_text=message_text,
-            )
+            message_data = await self.persist_message(message_text)
+            # Receivers clear the indicator when the message arrives.
+            self.cancel_typing_timers()
+            self.typing = self.typing_wanted = False
 
             await self.channel_layer.group_send(
                 self.room_group_name,
@@ -429,19 +640,102 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }
             )
 
-        elif message_type == 'typing':
+        elif message_type == 'resume':
+            # Client reconnected (or opened the page) and reports the newest
+            # message id it has; replay only what it missed.
+            try:
+                last_message_id = max(int(data.get('last_message_id') or 0), 0)
+            except (TypeError, ValueError):
+                last_message_id = 0
+
+            messages_data, has_more = await self.get_messages_after(last_message_id)
+            self.latest_message_id = max(
+                self.latest_message_id, last_message_id, *(message['id'] for message in messages_data),
+            )
+            await self.send(text_data=json.dumps({
+                'type': 'history',
+                'messages': messages_data,
+                'has_more': has_more,
+            }))
+
+        elif message_type == 'read':
+            try:
+                last_read_id = min(int(data.get('last_message_id') or 0), self.latest_message_id)
+            except (TypeError, ValueError):
+                return
+            if last_read_id <= self.last_read_id:
+                return
+
+            self.last_read_id = last_read_id
+            get_read_cursor_buffer().advance(self.appointment_id, self.user.id, last_read_id)
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
-                    'type': 'typing_update',
-                    'sender_id': self.user.id,
-                    'sender_name': self.get_user_display_name(),
-                    'is_typing': bool(data.get('is_typing')),
-                    'sender_channel': self.channel_name,
+                    'type': 'read_receipt',
+                    'user_id': self.user.id,
+                    'last_read_message_id': last_read_id,
                 }
             )
 
+        elif message_type == 'typing':
+            await self.set_typing(bool(data.get('is_typing')))
+
+    async def set_typing(self, is_typing):
+        """
+        Record the client's typing state. Repeats are dropped, changes are
+        broadcast at most once per CHAT_TYPING_MIN_INTERVAL (the latest state
+        wins), and "typing" expires after CHAT_TYPING_EXPIRY of silence.
+        """
+        if self.typing_expiry_task is not None and self.typing_expiry_task is not asyncio.current_task():
+            self.typing_expiry_task.cancel()
+        self.typing_expiry_task = None
+        if is_typing:
+            self.typing_expiry_task = asyncio.create_task(self.expire_typing(settings.CHAT_TYPING_EXPIRY))
+
+        self.typing_wanted = is_typing
+        if self.typing_task is not None or is_typing == self.typing:
+            # Either already broadcast, or a pending broadcast will pick it up.
+            return
+        wait = self.typing_sent_at + settings.CHAT_TYPING_MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            self.typing_task = asyncio.create_task(self.broadcast_typing_later(wait))
+        else:
+            await self.broadcast_typing()
+
+    async def broadcast_typing_later(self, delay):
+        await asyncio.sleep(delay)
+        self.typing_task = None
+        await self.broadcast_typing()
+
+    async def expire_typing(self, delay):
+        await asyncio.sleep(delay)
+        await self.set_typing(False)
+
+    async def broadcast_typing(self):
+        if self.typing_wanted == self.typing:
+            return
+        self.typing = self.typing_wanted
+        self.typing_sent_at = time.monotonic()
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_update',
+                'sender_id': self.user.id,
+                'sender_name': self.get_user_display_name(),
+                'is_typing': self.typing,
+                'sender_channel': self.channel_name,
+            }
+        )
+
+    def cancel_typing_timers(self):
+        for task in (self.typing_task, self.typing_expiry_task):
+            if task is not None:
+                task.cancel()
+        self.typing_task = self.typing_expiry_task = None
+
     async def chat_message(self, event):
+        if event.get('id'):
+            self.latest_message_id = max(self.latest_message_id, event['id'])
         await self.send(text_data=json.dumps({
             'type': 'message',
             'id': event.get('id'),
@@ -455,6 +749,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'attachment_name': event.get('attachment_name'),
             'attachment_size': event.get('attachment_size'),
             'is_image': event.get('is_image', False),
+            'thumbnail_url': event.get('thumbnail_url'),
             'is_self': event.get('sender_id') == self.user.id,
         }))
 
@@ -469,45 +764,76 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'is_typing': event.get('is_typing', False),
         }))
 
+    async def read_receipt(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'read',
+            'user_id': event.get('user_id'),
+            'last_read_message_id': event.get('last_read_message_id'),
+        }))
+
     async def presence_update(self, event):
         await self.send(text_data=json.dumps({
             'type': 'presence',
             'online_user_ids': event.get('online_user_ids', []),
         }))
 
-    async def add_online_user(self):
-        lock = self.get_presence_lock()
-        async with lock:
-            room_state = self.room_connections[self.room_group_name]
-            room_state[self.user.id].add(self.channel_name)
-            return sorted(room_state.keys())
-
-    async def remove_online_user(self):
-        lock = self.get_presence_lock()
-        async with lock:
-            room_state = self.room_connections.get(self.room_group_name)
-            if not room_state:
-                return []
-
-            user_connections = room_state.get(self.user.id)
-            if user_connections:
-                user_connections.discard(self.channel_name)
-                if not user_connections:
-                    room_state.pop(self.user.id, None)
-
-            if not room_state:
-                self.room_connections.pop(self.room_group_name, None)
-                return []
-
-            return sorted(room_state.keys())
+    async def presence_heartbeat(self):
+        # Refresh this socket's registration well within its TTL so it only
+        # expires if the worker dies without running disconnect().
+        interval = self.presence.ttl / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.presence.heartbeat(self.room_group_name, self.user.id, self.channel_name)
+            except Exception:
+                # A registry blip must not end the heartbeat; the next beat
+                # re-registers the socket before its TTL runs out.
+                logger.exception('Chat presence heartbeat failed for %s', self.channel_name)
 
     def get_user_display_name(self):
         full_name = f'{self.user.first_name} {self.user.last_name}'.strip()
         return full_name or self.user.username or self.user.email
 
+    async def get_messages_after(self, last_message_id):
+        # In write-behind mode, messages already broadcast may still be queued
+        # in this process's writer. Take them before querying, so one flushed
+        # in between is found in the database instead of missed.
+        writer = get_chat_writer()
+        unsaved = writer.unsaved(self.appointment_id, last_message_id) if writer else []
+        return await self.load_messages_after(last_message_id, unsaved)
+
     @database_sync_to_async
-    def get_appointment(self, appointment_id):
-        return Appointment.objects.filter(id=appointment_id).first()
+    def load_messages_after(self, last_message_id, unsaved):
+        chat_messages = list(
+            ChatMessage.objects.filter(
+                appointment_id=self.appointment_id,
+                id__gt=last_message_id,
+            ).values(*CHAT_MESSAGE_FIELDS).order_by('id')[:CHAT_RESUME_BATCH_SIZE + 1]
+        )
+        if unsaved:
+            stored_ids = {message['id'] for message in chat_messages}
+            senders = get_user_model().objects.in_bulk({message.sender_id for message in unsaved})
+            chat_messages = sorted(
+                chat_messages + [
+                    chat_message_row(message, sender=senders[message.sender_id])
+                    for message in unsaved if message.id not in stored_ids and message.sender_id in senders
+                ],
+                key=lambda message: message['id'],
+            )
+        has_more = len(chat_messages) > CHAT_RESUME_BATCH_SIZE
+        return (
+            [serialize_chat_message(message, self.user) for message in chat_messages[:CHAT_RESUME_BATCH_SIZE]],
+            has_more,
+        )
+
+    async def persist_message(self, message_text):
+        """Store a socket message and return its broadcast payload."""
+        writer = get_chat_writer()
+        if writer is None:
+            return await self.save_message(self.appointment_id, self.user.id, message_text)
+        # Write-behind: the message is journaled and gets its id now; the
+        # INSERT follows in the next batch.
+        return chat_message_event(await writer.add(self.appointment_id, self.user.id, message_text))
 
     @database_sync_to_async
     def save_message(self, appointment_id, sender_id, message_text):
@@ -516,17 +842,43 @@ class ChatConsumer(AsyncWebsocketConsumer):
             sender_id=sender_id,
             message=message_text,
         )
-        local_timestamp = timezone.localtime(message.created_at)
+        return chat_message_event(message)
 
-        return {
-            'id': message.id,
-            'message': message.message,
-            'sender_id': sender_id,
-            'created_at': local_timestamp.isoformat(),
-            'created_at_display': local_timestamp.strftime('%I:%M %p').lstrip('0'),
-            'has_attachment': False,
-            'attachment_url': None,
-            'attachment_name': None,
-            'attachment_size': 0,
-            'is_image': False,
-        }
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Pushes the current user's new notifications and unread count."""
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if not user or user.is_anonymous:
+            await self.close(code=4001)
+            return
+
+        self.user = user
+        self.group_name = user_notifications_group(user.id)
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        unread_count = await database_sync_to_async(get_unread_notification_count)(user.id)
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'unread_count': unread_count,
+        }))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_message(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification',
+            'notification': event.get('notification', {}),
+            'unread_count': event.get('unread_count', 0),
+        }))
+
+    async def unread_count_update(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'unread_count',
+            'unread_count': event.get('unread_count', 0),
+        }))
@@ -0,0 +1,42 @@
+"""
+Cached counter snapshots for the dashboards.
+
+Counters are computed with one conditional aggregate query and kept in the
+cache until an Appointment for the doctor changes (see medical.signals).
+Counts over the dashboard's time window are not cached: the dashboard
+derives them from the window's appointment list, which it fetches anyway.
+"""
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Appointment
+
+DOCTOR_DASHBOARD_CACHE_TIMEOUT = 60  # seconds
+DOCTOR_DASHBOARD_STATUSES = ['scheduled', 'confirmed', 'requested', 'pending_approval']
+PENDING_APPROVAL_STATUSES = ['requested', 'pending_approval']
+
+
+def doctor_dashboard_cache_key(doctor_id):
+    return f'doctor_dashboard_counters:{doctor_id}'
+
+
+def get_doctor_dashboard_counters(doctor):
+    """Return the doctor's dashboard counters, from cache when possible."""
+    cache_key = doctor_dashboard_cache_key(doctor.id)
+    counters = cache.get(cache_key)
+    if counters is not None:
+        return counters
+
+    counters = Appointment.objects.filter(doctor=doctor).aggregate(
+        pending_appointments_count=Count('id', filter=Q(status__in=PENDING_APPROVAL_STATUSES)),
+        total_patients=Count(
+            'patient', filter=Q(status='completed', video_call_status='ended'), distinct=True
+        ),
+    )
+    cache.set(cache_key, counters, DOCTOR_DASHBOARD_CACHE_TIMEOUT)
+    return counters
+
+
+def invalidate_doctor_dashboard_counters(doctor_id):
+    cache.delete(doctor_dashboard_cache_key(doctor_id))
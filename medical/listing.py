@@ -0,0 +1,243 @@
+"""
+Keyset-paginated list pages.
+
+The admin and staff list views (doctors, patients, admins, hospitals,
+appointments) used to render whole tables. paginate_list() gives them one
+shared engine:
+
+- Keyset (cursor) pagination: a page is fetched with ``WHERE (sort
+  columns) > (values of the last row) LIMIT n`` instead of OFFSET, so page
+  1000 costs the same as page 1. Cursors are signed so they cannot be
+  forged into arbitrary filters.
+- Whitelisted sorting, exact-match filters and an optional ``q`` search.
+- Totals: an exact COUNT(*) for small results; on PostgreSQL, results the
+  planner estimates above APPROXIMATE_COUNT_THRESHOLD rows report the
+  estimate instead of scanning the table.
+
+Sort orderings must only use non-null columns; the primary key is appended
+as a tie-breaker automatically.
+"""
+
+import json
+
+from django.core import signing
+from django.db import connections
+from django.db.models import Q
+
+LIST_PAGE_SIZE = 25
+MAX_LIST_PAGE_SIZE = 100
+APPROXIMATE_COUNT_THRESHOLD = 10000
+
+_CURSOR_SALT = 'medical.listing.cursor'
+
+
+def _parse_ordering(model, ordering):
+    """Turn ('-created_at', ...) into [(path, descending), ...] ending in the pk."""
+    parsed = []
+    for field in ordering:
+        descending = field.startswith('-')
+        path = field.lstrip('-')
+        if path == 'pk':
+            path = model._meta.pk.name
+        parsed.append((path, descending))
+    if parsed[-1][0] != model._meta.pk.name:
+        parsed.append((model._meta.pk.name, parsed[-1][1]))
+    return parsed
+
+
+def _resolve_field(model, path):
+    field = None
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        model = field.related_model
+    return field
+
+
+def _row_value(obj, path):
+    for name in path.split('__'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _encode_cursor(ordering, obj):
+    values = []
+    for path, _ in ordering:
+        value = _row_value(obj, path)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        elif not isinstance(value, (int, float, bool, str, type(None))):
+            value = str(value)
+        values.append(value)
+    return signing.dumps(values, salt=_CURSOR_SALT, compress=True)
+
+
+def _decode_cursor(model, ordering, cursor):
+    try:
+        values = signing.loads(cursor, salt=_CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    try:
+        return [
+            _resolve_field(model, path).to_python(value)
+            for (path, _), value in zip(ordering, values)
+        ]
+    except Exception:
+        return None
+
+
+def _keyset_filter(ordering, values, forward):
+    """Rows strictly after (forward) or before the row with these sort values."""
+    condition = Q()
+    equal_prefix = Q()
+    for (path, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending == forward else 'gt'
+        condition |= equal_prefix & Q(**{f'{path}__{lookup}': value})
+        equal_prefix &= Q(**{path: value})
+    return condition
+
+
+def count_rows(queryset, threshold=APPROXIMATE_COUNT_THRESHOLD):
+    """
+    Return (count, is_estimate). On PostgreSQL a planner estimate above the
+    threshold is returned as-is; everything else is counted exactly.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        try:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        except (ValueError, KeyError, IndexError, TypeError):
+            estimate = None
+        if estimate is not None and estimate > threshold:
+            return estimate, True
+    return queryset.count(), False
+
+
+class ListPage:
+    """One page of a list view plus what its controls need to render."""
+
+    def __init__(self, request, object_list, *, total_count, count_is_estimate,
+                 has_next, has_previous, next_cursor, previous_cursor,
+                 sort, sort_options, filter_controls, search, searchable):
+        self.request = request
+        self.object_list = object_list
+        self.total_count = total_count
+        self.count_is_estimate = count_is_estimate
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.sort = sort
+        self.sort_options = sort_options
+        self.filter_controls = filter_controls
+        self.search = search
+        self.searchable = searchable
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _url_with(self, **params):
+        query = self.request.GET.copy()
+        for key in ('after', 'before'):
+            query.pop(key, None)
+        for key, value in params.items():
+            query[key] = value
+        return f'?{query.urlencode()}'
+
+    @property
+    def next_url(self):
+        return self._url_with(after=self.next_cursor) if self.has_next else None
+
+    @property
+    def previous_url(self):
+        return self._url_with(before=self.previous_cursor) if self.has_previous else None
+
+
+def paginate_list(request, queryset, sorts, *, filters=None, search_fields=(),
+                  page_size=LIST_PAGE_SIZE):
+    """
+    Return a ListPage for a list view.
+
+    ``sorts`` maps a ``sort`` query value to ``(label, ordering)``; the first
+    entry is the default. ``filters`` maps a query parameter to
+    ``(label, lookup, choices)`` and only values listed in ``choices`` are
+    applied. ``search_fields`` are matched case-insensitively against ``q``.
+    Navigation uses the signed ``after`` / ``before`` cursors.
+    """
+    model = queryset.model
+    filters = filters or {}
+
+    sort = request.GET.get('sort')
+    if sort not in sorts:
+        sort = next(iter(sorts))
+    ordering = _parse_ordering(model, sorts[sort][1])
+
+    filter_controls = []
+    for param, (label, lookup, choices) in filters.items():
+        choices = [(str(value), choice_label) for value, choice_label in choices]
+        selected = request.GET.get(param, '')
+        if selected and selected in dict(choices):
+            queryset = queryset.filter(**{lookup: selected})
+        else:
+            selected = ''
+        filter_controls.append({
+            'param': param, 'label': label, 'choices': choices, 'selected': selected,
+        })
+
+    search = (request.GET.get('q') or '').strip() if search_fields else ''
+    if search:
+        condition = Q()
+        for field in search_fields:
+            condition |= Q(**{f'{field}__icontains': search})
+        queryset = queryset.filter(condition)
+
+    try:
+        page_size = min(max(int(request.GET.get('per_page', page_size)), 1), MAX_LIST_PAGE_SIZE)
+    except ValueError:
+        pass
+
+    total_count, count_is_estimate = count_rows(queryset)
+
+    forward_order = [f"{'-' if descending else ''}{path}" for path, descending in ordering]
+    backward_order = [f"{'' if descending else '-'}{path}" for path, descending in ordering]
+
+    after = before = None
+    if request.GET.get('before'):
+        before = _decode_cursor(model, ordering, request.GET['before'])
+    elif request.GET.get('after'):
+        after = _decode_cursor(model, ordering, request.GET['after'])
+
+    if before is not None:
+        rows = list(queryset.filter(_keyset_filter(ordering, before, forward=False))
+                    .order_by(*backward_order)[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        page_qs = queryset
+        if after is not None:
+            page_qs = page_qs.filter(_keyset_filter(ordering, after, forward=True))
+        rows = list(page_qs.order_by(*forward_order)[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = after is not None
+
+    return ListPage(
+        request,
+        rows,
+        total_count=total_count,
+        count_is_estimate=count_is_estimate,
+        has_next=has_next and bool(rows),
+        has_previous=has_previous and bool(rows),
+        next_cursor=_encode_cursor(ordering, rows[-1]) if rows else None,
+        previous_cursor=_encode_cursor(ordering, rows[0]) if rows else None,
+        sort=sort,
+        sort_options=[(name, label) for name, (label, _) in sorts.items()],
+        filter_controls=filter_controls,
+        search=search,
+        searchable=bool(search_fields),
+    )
@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from medical.attachments import describe_attachment, is_raster_image
+from medical.models import ChatMessage
+
+METADATA_FIELDS = [
+    'attachment_name', 'attachment_size', 'content_type', 'is_image', 'attachment_width', 'attachment_height',
+]
+
+
+class Command(BaseCommand):
+    help = 'Record name, size, type and dimensions for chat attachments uploaded before they were stored on the row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows read and updated per query')
+
+    def handle(self, *args, **options):
+        pending = ChatMessage.objects.exclude(attachment='').exclude(attachment__isnull=True).filter(
+            attachment_name='',
+        ).order_by('id')
+
+        updated = missing = 0
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for message in batch:
+                last_id = message.id
+                message.attachment_name = os.path.basename(message.attachment.name)
+                try:
+                    with message.attachment.open('rb') as file:
+                        metadata = describe_attachment(file)
+                except FileNotFoundError:
+                    # Keep the row out of later runs; it is served as a plain download.
+                    metadata = {'content_type': 'application/octet-stream'}
+                    missing += 1
+                for field, value in metadata.items():
+                    setattr(message, field, value)
+                message.is_image = is_raster_image(message.content_type)
+            ChatMessage.objects.bulk_update(batch, METADATA_FIELDS)
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled attachment metadata for {updated} message(s); {missing} file(s) missing from storage.'
+        ))
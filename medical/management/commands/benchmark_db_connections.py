@@ -0,0 +1,54 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request database connection overhead with the current connection settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Number of simulated requests')
+
+    def handle(self, *args, **options):
+        total_requests = options['requests']
+        if total_requests < 1:
+            raise CommandError('--requests must be at least 1.')
+        settings_dict = connection.settings_dict
+        self.stdout.write(
+            f"Backend: {settings_dict['ENGINE']}  CONN_MAX_AGE={settings_dict.get('CONN_MAX_AGE')}  "
+            f"CONN_HEALTH_CHECKS={settings_dict.get('CONN_HEALTH_CHECKS')}  "
+            f"pool={bool(settings_dict.get('OPTIONS', {}).get('pool'))}"
+        )
+
+        connection_times = []
+        query_times = []
+        for _ in range(total_requests):
+            # Same lifecycle as a request: request_started / request_finished
+            # both run close_old_connections().
+            close_old_connections()
+
+            start = time.perf_counter()
+            connection.ensure_connection()
+            connected = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            finished = time.perf_counter()
+
+            connection_times.append((connected - start) * 1000)
+            query_times.append((finished - connected) * 1000)
+            close_old_connections()
+
+        connections.close_all()
+        self.report('connection setup', connection_times)
+        self.report('query (SELECT 1)', query_times)
+
+    def report(self, label, samples):
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        self.stdout.write(self.style.SUCCESS(
+            f'{label:18} mean={statistics.mean(samples):7.2f} ms  '
+            f'p50={statistics.median(samples):7.2f} ms  p95={p95:7.2f} ms'
+        ))
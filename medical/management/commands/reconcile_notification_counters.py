@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from medical.notifications import set_unread_notification_count
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Recompute cached unread notification counters from the database (run periodically)'
+
+    def handle(self, *args, **options):
+        users = User.objects.annotate(
+            unread_count=Count('notifications', filter=Q(notifications__is_read=False))
+        ).values_list('id', 'unread_count')
+
+        total = 0
+        for user_id, unread_count in users.iterator():
+            set_unread_notification_count(user_id, unread_count)
+            total += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled unread notification counters for {total} user(s).')
+        )
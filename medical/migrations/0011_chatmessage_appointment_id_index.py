@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 02:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0010_appointment_doctor_change_requested_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(fields=["appointment", "id"], name="chat_msg_appt_id_idx"),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 02:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0011_chatmessage_appointment_id_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(fields=["doctor", "status", "appointment_date"], name="appt_doctor_status_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(fields=["patient", "status", "appointment_date"], name="appt_patient_status_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(fields=["hospital", "requested_by", "-created_at"], name="appt_hosp_requested_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(fields=["doctor", "status", "video_call_status", "patient"], name="appt_doctor_call_status_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(condition=models.Q(("status__in", ["requested", "pending_approval", "scheduled", "confirmed", "in_progress"])), fields=["doctor", "appointment_date"], name="appt_doctor_active_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(condition=models.Q(("status__in", ["requested", "pending_approval", "scheduled", "confirmed", "in_progress"])), fields=["patient", "appointment_date"], name="appt_patient_active_date_idx"),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.3 on 2026-10-18 02:52
+
+import warnings
+
+import django.core.validators
+from django.db import DatabaseError, migrations, models
+
+# On PostgreSQL the database itself refuses overlapping active bookings for a
+# doctor. The range is built from UTC timestamps so the expression is
+# immutable and can be indexed by GiST. Other databases rely on the row lock
+# taken in medical.scheduling.reserve_slot().
+CONSTRAINT_NAME = "appt_doctor_no_overlap"
+ADD_CONSTRAINT_SQL = f"""
+ALTER TABLE medical_appointment ADD CONSTRAINT {CONSTRAINT_NAME}
+EXCLUDE USING gist (
+    doctor_id WITH =,
+    tsrange(
+        appointment_date AT TIME ZONE 'UTC',
+        (appointment_date AT TIME ZONE 'UTC') + make_interval(mins => duration_minutes)
+    ) WITH &&
+)
+WHERE (status IN ('requested', 'pending_approval', 'scheduled', 'confirmed', 'in_progress'))
+"""
+
+
+def add_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    try:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SAVEPOINT appt_no_overlap")
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+                cursor.execute(ADD_CONSTRAINT_SQL)
+            except DatabaseError:
+                cursor.execute("ROLLBACK TO SAVEPOINT appt_no_overlap")
+                raise
+            cursor.execute("RELEASE SAVEPOINT appt_no_overlap")
+    except DatabaseError as exc:
+        # Existing overlapping bookings or a missing btree_gist permission;
+        # booking stays safe through the application-level lock.
+        warnings.warn(f"Skipped {CONSTRAINT_NAME}: {exc}")
+
+
+def drop_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"ALTER TABLE medical_appointment DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0012_appointment_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appointment",
+            name="duration_minutes",
+            field=models.PositiveSmallIntegerField(
+                default=30,
+                help_text="Length of the booked slot in minutes",
+                validators=[
+                    django.core.validators.MinValueValidator(5),
+                    django.core.validators.MaxValueValidator(240),
+                ],
+            ),
+        ),
+        migrations.RunPython(add_overlap_constraint, drop_overlap_constraint),
+    ]
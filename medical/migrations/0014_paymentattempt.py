@@ -0,0 +1,66 @@
+# Generated by Django 5.1.3 on 2026-10-18 02:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0013_appointment_duration_minutes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentAttempt",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("pidx", models.CharField(help_text="Khalti payment identifier", max_length=100, unique=True)),
+                ("purchase_order_id", models.CharField(max_length=100)),
+                ("amount", models.PositiveIntegerField(help_text="Amount in paisa")),
+                ("payment_url", models.URLField(blank=True, max_length=500)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("completed", "Completed"),
+                            ("expired", "Expired"),
+                            ("canceled", "Canceled"),
+                            ("refunded", "Refunded"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("gateway_status", models.CharField(blank=True, help_text="Last status reported by Khalti", max_length=50)),
+                ("transaction_id", models.CharField(blank=True, max_length=100)),
+                ("expires_at", models.DateTimeField(blank=True, null=True)),
+                ("last_checked_at", models.DateTimeField(blank=True, null=True)),
+                ("check_count", models.PositiveIntegerField(default=0)),
+                ("settled_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("patient", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="payment_attempts", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "Payment Attempt",
+                "verbose_name_plural": "Payment Attempts",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "pending")),
+                        fields=["last_checked_at"],
+                        name="payment_pending_check_idx",
+                    ),
+                    models.Index(
+                        fields=["patient", "status", "-created_at"],
+                        name="payment_patient_status_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
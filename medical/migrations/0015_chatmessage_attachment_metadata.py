@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-18 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0014_paymentattempt"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="attachment_height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="attachment_size",
+            field=models.PositiveBigIntegerField(default=0, help_text="Attachment size in bytes"),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="attachment_thumbnail",
+            field=models.FileField(blank=True, null=True, upload_to="chat_thumbnails/%Y/%m/%d/"),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="attachment_width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="content_type",
+            field=models.CharField(
+                blank=True, help_text="Attachment MIME type, sniffed from its content", max_length=100
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0015_chatmessage_attachment_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="attachment_name",
+            field=models.CharField(blank=True, help_text="Original file name", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="is_image",
+            field=models.BooleanField(default=False, help_text="Attachment is a raster image safe to show inline"),
+        ),
+    ]
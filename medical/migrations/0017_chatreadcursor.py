@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-18 03:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0016_chatmessage_attachment_name_is_image"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatReadCursor",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("last_read_message_id", models.PositiveBigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("appointment", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="chat_read_cursors", to="medical.appointment")),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="chat_read_cursors", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "Chat Read Cursor",
+                "verbose_name_plural": "Chat Read Cursors",
+                "constraints": [models.UniqueConstraint(fields=("appointment", "user"), name="chat_read_cursor_unique")],
+            },
+        ),
+    ]
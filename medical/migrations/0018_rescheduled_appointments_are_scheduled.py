@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:02
+
+from django.db import IntegrityError, migrations, transaction
+
+
+def reschedule_to_scheduled(apps, schema_editor):
+    # update_appointment_time() used to leave moved appointments as
+    # 'rescheduled', which is not an active status, so their slot could be
+    # booked again. Rows whose slot has been taken since then would violate
+    # appt_doctor_no_overlap on PostgreSQL; those keep 'rescheduled' for
+    # staff to sort out.
+    Appointment = apps.get_model("medical", "Appointment")
+    db_alias = schema_editor.connection.alias
+    for appointment_id in Appointment.objects.using(db_alias).filter(status="rescheduled").values_list("id", flat=True):
+        try:
+            with transaction.atomic(using=db_alias):
+                Appointment.objects.using(db_alias).filter(id=appointment_id).update(status="scheduled")
+        except IntegrityError:
+            pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medical", "0017_chatreadcursor"),
+    ]
+
+    operations = [
+        migrations.RunPython(reschedule_to_scheduled, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
+import os
 import uuid
 from django.db import models
 from django.conf import settings
-from django.core.validators import EmailValidator, RegexValidator
+from django.core.validators import EmailValidator, MaxValueValidator, MinValueValidator, RegexValidator
+
+from .attachments import describe_attachment, is_raster_image
 
 
 class Hospital(models.Model):
@@ -91,6 +94,64 @@ class PatientProfile(models.Model):
         verbose_name_plural = "Patient Profiles"
 
 
+class PaymentAttempt(models.Model):
+    """One Khalti ePayment session started for a patient's registration fee."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+        ('expired', 'Expired'),
+        ('canceled', 'Canceled'),
+        ('refunded', 'Refunded'),
+        ('failed', 'Failed'),
+    ]
+    
+    patient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='payment_attempts'
+    )
+    pidx = models.CharField(max_length=100, unique=True, help_text="Khalti payment identifier")
+    purchase_order_id = models.CharField(max_length=100)
+    amount = models.PositiveIntegerField(help_text="Amount in paisa")
+    payment_url = models.URLField(max_length=500, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    gateway_status = models.CharField(max_length=50, blank=True, help_text="Last status reported by Khalti")
+    transaction_id = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+    check_count = models.PositiveIntegerField(default=0)
+    settled_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.pidx} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Payment Attempt"
+        verbose_name_plural = "Payment Attempts"
+        ordering = ['-created_at']
+        indexes = [
+            # Reconciliation batches: pending attempts, least recently checked first.
+            models.Index(
+                fields=['last_checked_at'],
+                name='payment_pending_check_idx',
+                condition=models.Q(status='pending'),
+            ),
+            # Reusing a patient's open attempt instead of initiating another.
+            models.Index(fields=['patient', 'status', '-created_at'], name='payment_patient_status_idx'),
+        ]
+
+
+# Statuses of appointments that still need attention; the partial indexes on
+# Appointment only cover these rows.
+ACTIVE_APPOINTMENT_STATUSES = ['requested', 'pending_approval', 'scheduled', 'confirmed', 'in_progress']
+
+# Appointments occupy [appointment_date, appointment_date + duration_minutes).
+DEFAULT_APPOINTMENT_DURATION = 30  # minutes
+MAX_APPOINTMENT_DURATION = 240  # minutes
+
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ('requested', 'Requested'),
@@ -126,6 +187,11 @@ class Appointment(models.Model):
         related_name='appointments'
     )
     appointment_date = models.DateTimeField()
+    duration_minutes = models.PositiveSmallIntegerField(
+        default=DEFAULT_APPOINTMENT_DURATION,
+        validators=[MinValueValidator(5), MaxValueValidator(MAX_APPOINTMENT_DURATION)],
+        help_text="Length of the booked slot in minutes"
+    )
     symptoms = models.TextField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     status = models.CharField(
@@ -229,6 +295,31 @@ class Appointment(models.Model):
         verbose_name = "Appointment"
         verbose_name_plural = "Appointments"
         ordering = ['appointment_date']
+        indexes = [
+            # Doctor dashboard window / pending lists and the pending_appointments view.
+            models.Index(fields=['doctor', 'status', 'appointment_date'], name='appt_doctor_status_date_idx'),
+            # Patient dashboard upcoming / pending requests.
+            models.Index(fields=['patient', 'status', 'appointment_date'], name='appt_patient_status_date_idx'),
+            # Hospital admin manage_appointments (newest first).
+            models.Index(fields=['hospital', 'requested_by', '-created_at'], name='appt_hosp_requested_idx'),
+            # Completed-consultation counters; patient is included so the
+            # distinct-patient count is answered from the index alone.
+            models.Index(
+                fields=['doctor', 'status', 'video_call_status', 'patient'],
+                name='appt_doctor_call_status_idx',
+            ),
+            # Only the small set of active rows per doctor/patient, ordered by date.
+            models.Index(
+                fields=['doctor', 'appointment_date'],
+                name='appt_doctor_active_date_idx',
+                condition=models.Q(status__in=ACTIVE_APPOINTMENT_STATUSES),
+            ),
+            models.Index(
+                fields=['patient', 'appointment_date'],
+                name='appt_patient_active_date_idx',
+                condition=models.Q(status__in=ACTIVE_APPOINTMENT_STATUSES),
+            ),
+        ]
 
 
 class Availability(models.Model):
@@ -280,16 +371,69 @@ class ChatMessage(models.Model):
         blank=True,
         null=True
     )
+    # Recorded when the attachment is saved so serving and listing never
+    # touch storage; backfill_chat_attachments fills in older rows.
+    attachment_name = models.CharField(max_length=255, blank=True, help_text="Original file name")
+    attachment_size = models.PositiveBigIntegerField(default=0, help_text="Attachment size in bytes")
+    content_type = models.CharField(max_length=100, blank=True, help_text="Attachment MIME type, sniffed from its content")
+    is_image = models.BooleanField(default=False, help_text="Attachment is a raster image safe to show inline")
+    attachment_width = models.PositiveIntegerField(null=True, blank=True)
+    attachment_height = models.PositiveIntegerField(null=True, blank=True)
+    attachment_thumbnail = models.FileField(
+        upload_to='chat_thumbnails/%Y/%m/%d/',
+        blank=True,
+        null=True
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     
     def __str__(self):
         return f"{self.sender.first_name} {self.sender.last_name}: {self.message[:50]}..."
     
+    def save(self, *args, **kwargs):
+        if self.attachment and not self.attachment._committed:
+            # A new upload: describe it while it is still a local file.
+            self.attachment_name = os.path.basename(self.attachment.name)
+            for field, value in describe_attachment(self.attachment.file).items():
+                setattr(self, field, value)
+        if self.attachment:
+            self.is_image = is_raster_image(self.content_type)
+        super().save(*args, **kwargs)
+    
     class Meta:
         verbose_name = "Chat Message"
         verbose_name_plural = "Chat Messages"
         ordering = ['created_at']
+        indexes = [
+            # Keyset pagination of a conversation (after_id / before_id).
+            models.Index(fields=['appointment', 'id'], name='chat_msg_appt_id_idx'),
+        ]
+
+
+class ChatReadCursor(models.Model):
+    """The newest chat message a participant has read in an appointment's chat."""
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name='chat_read_cursors'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='chat_read_cursors'
+    )
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id} read {self.appointment_id} up to {self.last_read_message_id}"
+    
+    class Meta:
+        verbose_name = "Chat Read Cursor"
+        verbose_name_plural = "Chat Read Cursors"
+        constraints = [
+            models.UniqueConstraint(fields=['appointment', 'user'], name='chat_read_cursor_unique'),
+        ]
 
 
 class Notification(models.Model):
@@ -0,0 +1,99 @@
+"""
+Per-user unread notification counters.
+
+The counter lives in the cache and is adjusted with atomic incr/decr when
+notifications are created (medical.signals) or cleared. A missing key is
+rebuilt from the database on the next read, and the
+reconcile_notification_counters command corrects any drift.
+
+New notifications and counter changes are also pushed to the recipient's
+``user_<id>`` channel group, which NotificationConsumer joins.
+"""
+
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+UNREAD_NOTIFICATIONS_CACHE_TIMEOUT = 60 * 60 * 24  # seconds
+
+
+def unread_notifications_cache_key(user_id):
+    return f'unread_notifications:{user_id}'
+
+
+def count_unread_notifications(user_id):
+    return Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+
+
+def get_unread_notification_count(user_id):
+    cache_key = unread_notifications_cache_key(user_id)
+    count = cache.get(cache_key)
+    if count is None:
+        count = count_unread_notifications(user_id)
+        # add() so a counter created concurrently by an increment is kept.
+        cache.add(cache_key, count, UNREAD_NOTIFICATIONS_CACHE_TIMEOUT)
+    return max(count, 0)
+
+
+def adjust_unread_notification_count(user_id, delta):
+    """Atomically add ``delta`` to the counter if it is currently cached."""
+    if not delta:
+        return
+    try:
+        cache.incr(unread_notifications_cache_key(user_id), delta)
+    except ValueError:
+        # Not cached: the next read recounts from the database.
+        pass
+
+
+def set_unread_notification_count(user_id, count):
+    cache.set(unread_notifications_cache_key(user_id), count, UNREAD_NOTIFICATIONS_CACHE_TIMEOUT)
+
+
+def forget_unread_notification_count(user_id):
+    cache.delete(unread_notifications_cache_key(user_id))
+
+
+def user_notifications_group(user_id):
+    return f'user_{user_id}'
+
+
+def _group_send(user_id, event):
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(user_notifications_group(user_id), event)
+    except Exception:
+        # Pushes run after the commit; the page catches up on its next load.
+        logger.exception('Could not push %s to user %s', event['type'], user_id)
+
+
+def push_notification(notification):
+    """Send a newly created notification to the recipient's open pages."""
+    _group_send(notification.recipient_id, {
+        'type': 'notification_message',
+        'notification': {
+            'id': notification.id,
+            'notification_type': notification.notification_type,
+            'title': notification.title,
+            'message': notification.message,
+            'appointment_id': notification.appointment_id,
+            'created_at': timezone.localtime(notification.created_at).isoformat(),
+        },
+        'unread_count': get_unread_notification_count(notification.recipient_id),
+    })
+
+
+def push_unread_notification_count(user_id):
+    _group_send(user_id, {
+        'type': 'unread_count_update',
+        'unread_count': get_unread_notification_count(user_id),
+    })
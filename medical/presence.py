@@ -0,0 +1,146 @@
+"""
+Chat presence registry.
+
+ChatConsumer records which users have a socket open in a chat room. With
+several Daphne workers the registry has to be shared, so it is pluggable:
+
+- RedisPresenceBackend keeps one sorted set per room. Members are
+  ``<user_id>:<channel_name>`` scored by their expiry time, so looking up
+  who is online is a range query and sockets of a crashed worker expire
+  once their heartbeat stops.
+- InMemoryPresenceBackend does the same inside one process (development
+  and tests).
+
+The backend is chosen with settings.CHAT_PRESENCE_BACKEND.
+"""
+
+import asyncio
+import math
+import time
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_PRESENCE_TTL = 90  # seconds
+
+
+def _member(user_id, channel_name):
+    return f'{user_id}:{channel_name}'
+
+
+def _user_ids(members):
+    user_ids = set()
+    for member in members:
+        if isinstance(member, bytes):
+            member = member.decode()
+        user_ids.add(int(member.split(':', 1)[0]))
+    return sorted(user_ids)
+
+
+class BasePresenceBackend:
+    def __init__(self, ttl=None):
+        self.ttl = ttl or getattr(settings, 'CHAT_PRESENCE_TTL', DEFAULT_PRESENCE_TTL)
+
+    async def add(self, room, user_id, channel_name):
+        """Register a socket and return the online user ids of the room."""
+        raise NotImplementedError
+
+    async def remove(self, room, user_id, channel_name):
+        """Unregister a socket and return the online user ids of the room."""
+        raise NotImplementedError
+
+    async def heartbeat(self, room, user_id, channel_name):
+        """Extend a socket's registration by another TTL."""
+        await self.add(room, user_id, channel_name)
+
+    async def online_user_ids(self, room):
+        raise NotImplementedError
+
+
+class InMemoryPresenceBackend(BasePresenceBackend):
+    def __init__(self, ttl=None):
+        super().__init__(ttl)
+        # room -> {member: expiry}. The methods never await, so each one is
+        # atomic on the event loop.
+        self.rooms = {}
+
+    def _live_members(self, room, now):
+        members = self.rooms.get(room, {})
+        for member in [m for m, expires_at in members.items() if expires_at <= now]:
+            del members[member]
+        if not members:
+            self.rooms.pop(room, None)
+        return members
+
+    async def add(self, room, user_id, channel_name):
+        now = time.monotonic()
+        self.rooms.setdefault(room, {})[_member(user_id, channel_name)] = now + self.ttl
+        return _user_ids(self._live_members(room, now))
+
+    async def remove(self, room, user_id, channel_name):
+        self.rooms.get(room, {}).pop(_member(user_id, channel_name), None)
+        return _user_ids(self._live_members(room, time.monotonic()))
+
+    async def online_user_ids(self, room):
+        return _user_ids(self._live_members(room, time.monotonic()))
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    key_prefix = 'chat_presence:'
+
+    def __init__(self, ttl=None, url=None):
+        super().__init__(ttl)
+        self.url = url or settings.REDIS_URL
+        # redis.asyncio clients are bound to the event loop they were created on.
+        self.clients = weakref.WeakKeyDictionary()
+
+    def get_client(self):
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            client = redis.from_url(self.url)
+            self.clients[loop] = client
+        return client
+
+    def _key(self, room):
+        return f'{self.key_prefix}{room}'
+
+    async def _update(self, room, add_member=None, remove_member=None):
+        key = self._key(room)
+        now = time.time()
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            if add_member:
+                pipe.zadd(key, {add_member: now + self.ttl})
+            if remove_member:
+                pipe.zrem(key, remove_member)
+            pipe.zremrangebyscore(key, '-inf', now)
+            pipe.zrangebyscore(key, now, '+inf')
+            pipe.expire(key, math.ceil(self.ttl * 2))
+            results = await pipe.execute()
+        return _user_ids(results[-2])
+
+    async def add(self, room, user_id, channel_name):
+        return await self._update(room, add_member=_member(user_id, channel_name))
+
+    async def remove(self, room, user_id, channel_name):
+        return await self._update(room, remove_member=_member(user_id, channel_name))
+
+    async def online_user_ids(self, room):
+        members = await self.get_client().zrangebyscore(self._key(room), time.time(), '+inf')
+        return _user_ids(members)
+
+
+_backend = None
+
+
+def get_presence_backend():
+    global _backend
+    if _backend is None:
+        backend_path = getattr(
+            settings, 'CHAT_PRESENCE_BACKEND', 'medical.presence.InMemoryPresenceBackend'
+        )
+        _backend = import_string(backend_path)()
+    return _backend
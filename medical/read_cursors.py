@@ -0,0 +1,119 @@
+"""
+Per-participant chat read cursors.
+
+Instead of flagging every ChatMessage row as read, each participant has one
+ChatReadCursor per appointment holding the newest message id they have
+seen; everything at or below it counts as read.
+
+Chat sockets report what the user has seen with ``read`` frames. Reports
+are coalesced per process in a ReadCursorBuffer, keeping only the highest
+id per (appointment, user), and written every READ_CURSOR_FLUSH_INTERVAL
+seconds as a single multi-row upsert. Cursors only move forward, even when
+two workers flush out of order.
+"""
+
+import asyncio
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import ChatReadCursor
+
+logger = logging.getLogger(__name__)
+
+READ_CURSOR_FLUSH_INTERVAL = 2  # seconds
+
+
+def advance_read_cursors(entries):
+    """
+    Move cursors forward. ``entries`` is an iterable of
+    (appointment_id, user_id, message_id); a cursor never moves back.
+    """
+    entries = list(entries)
+    if not entries:
+        return
+    using = router.db_for_write(ChatReadCursor)
+    connection = connections[using]
+    now = timezone.now()
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        with transaction.atomic(using=using):
+            for appointment_id, user_id, message_id in entries:
+                cursor, _ = ChatReadCursor.objects.select_for_update().get_or_create(
+                    appointment_id=appointment_id, user_id=user_id,
+                )
+                if message_id > cursor.last_read_message_id:
+                    cursor.last_read_message_id = message_id
+                    cursor.save(update_fields=['last_read_message_id', 'updated_at'])
+        return
+
+    table = connection.ops.quote_name(ChatReadCursor._meta.db_table)
+    greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+    params = []
+    for appointment_id, user_id, message_id in entries:
+        params.extend([appointment_id, user_id, message_id, now])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (appointment_id, user_id, last_read_message_id, updated_at) '
+            f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(entries))} '
+            f'ON CONFLICT (appointment_id, user_id) DO UPDATE SET '
+            f'last_read_message_id = {greatest}({table}.last_read_message_id, excluded.last_read_message_id), '
+            f'updated_at = excluded.updated_at',
+            params,
+        )
+
+
+def get_read_cursors(appointment_id):
+    """{user_id: last_read_message_id} for an appointment's chat."""
+    return dict(
+        ChatReadCursor.objects.filter(appointment_id=appointment_id).values_list('user_id', 'last_read_message_id')
+    )
+
+
+class ReadCursorBuffer:
+    def __init__(self, flush_interval=READ_CURSOR_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flush_task = None
+
+    def advance(self, appointment_id, user_id, message_id):
+        key = (appointment_id, user_id)
+        if message_id <= self.pending.get(key, 0):
+            return
+        self.pending[key] = message_id
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        entries = [(appointment_id, user_id, message_id) for (appointment_id, user_id), message_id in pending.items()]
+        try:
+            await database_sync_to_async(advance_read_cursors)(entries)
+        except Exception:
+            logger.exception('Could not save %s chat read cursor(s)', len(entries))
+            for (appointment_id, user_id), message_id in pending.items():
+                if message_id > self.pending.get((appointment_id, user_id), 0):
+                    self.pending[(appointment_id, user_id)] = message_id
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self.flush_later())
+
+
+# Buffers own timers, which belong to one event loop.
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_read_cursor_buffer():
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = ReadCursorBuffer()
+    return buffer
@@ -6,4 +6,5 @@ websocket_urlpatterns = [
     re_path(r'ws/video-call/(?P<room_id>[-\w]+)/$', consumers.VideoCallConsumer.as_asgi()),
     re_path(r'ws/call-invite/(?P<appointment_id>\d+)/$', consumers.CallInviteConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<appointment_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
 ]
@@ -0,0 +1,242 @@
+"""
+Slot-based scheduling.
+
+An appointment occupies ``[appointment_date, appointment_date +
+duration_minutes)``. While its status is in ACTIVE_APPOINTMENT_STATUSES no
+other active appointment of the same doctor may overlap it.
+
+- check_slot() validates a proposed booking: it must not overlap an active
+  appointment and, when the doctor has weekly Availability rows, it must
+  fit inside one of them.
+- reserve_slot() saves a new or rescheduled appointment atomically. It
+  locks the doctor's user row so concurrent bookings for one doctor are
+  checked one at a time.
+  On PostgreSQL the appt_doctor_no_overlap exclusion constraint (migration
+  0013) backs this up in the database.
+- free_slots() expands Availability into bookable slots for many doctors
+  at once, with one query for availability and one for bookings. Bookings
+  are loaded into an IntervalIndex, so each slot is checked in O(log n).
+- next_free_slots() answers "what are the next N free slots" for one or
+  many doctors from a per-doctor cache of the coming week's free slots.
+  The signals in medical/signals.py drop a doctor's entry whenever one of
+  their Appointment or Availability rows changes.
+
+Overlap lookups only scan appointments starting within MAX_APPOINTMENT_DURATION
+before the window, so they stay on the (doctor, appointment_date) index.
+"""
+
+import bisect
+import heapq
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import (
+    ACTIVE_APPOINTMENT_STATUSES,
+    DEFAULT_APPOINTMENT_DURATION,
+    MAX_APPOINTMENT_DURATION,
+    Appointment,
+    Availability,
+)
+
+OVERLAP_CONSTRAINT_NAME = 'appt_doctor_no_overlap'
+FREE_SLOTS_HORIZON = timedelta(days=7)
+# Also bounds how far the cached horizon lags behind the clock.
+FREE_SLOTS_CACHE_TIMEOUT = 15 * 60  # seconds
+
+
+def get_slot_minutes():
+    return getattr(settings, 'APPOINTMENT_SLOT_MINUTES', DEFAULT_APPOINTMENT_DURATION)
+
+
+class SlotUnavailable(Exception):
+    """The requested time overlaps a booking or is outside the doctor's hours."""
+
+
+class IntervalIndex:
+    """
+    Static set of half-open intervals answering "does [start, end) overlap
+    any of them?" with one binary search: intervals are sorted by start and
+    ``max_ends[i]`` is the latest end among the first i + 1 of them.
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.starts = [start for start, _ in self.intervals]
+        self.max_ends = []
+        latest = None
+        for _, end in self.intervals:
+            latest = end if latest is None or end > latest else latest
+            self.max_ends.append(latest)
+
+    def overlaps(self, start, end):
+        count = bisect.bisect_left(self.starts, end)
+        return count > 0 and self.max_ends[count - 1] > start
+
+
+def appointment_end(start, duration_minutes):
+    return start + timedelta(minutes=duration_minutes)
+
+
+def _active_bookings(doctor_ids, start, end, exclude_id=None):
+    """(doctor_id, start, end) of active appointments overlapping [start, end)."""
+    bookings = Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        status__in=ACTIVE_APPOINTMENT_STATUSES,
+        appointment_date__lt=end,
+        appointment_date__gt=start - timedelta(minutes=MAX_APPOINTMENT_DURATION),
+    )
+    if exclude_id is not None:
+        bookings = bookings.exclude(id=exclude_id)
+    rows = []
+    for doctor_id, booked_start, duration in bookings.values_list(
+        'doctor_id', 'appointment_date', 'duration_minutes'
+    ):
+        booked_end = appointment_end(booked_start, duration)
+        if booked_end > start:
+            rows.append((doctor_id, booked_start, booked_end))
+    return rows
+
+
+def availability_windows(availabilities, start, end):
+    """
+    Expand weekly Availability rows into concrete local-time windows that
+    intersect [start, end), keyed by doctor id.
+    """
+    tz = timezone.get_current_timezone()
+    by_weekday = {}
+    for availability in availabilities:
+        if availability.is_available and availability.start_time < availability.end_time:
+            by_weekday.setdefault(availability.day_of_week, []).append(availability)
+
+    windows = {}
+    day = timezone.localtime(start, tz).date()
+    last_day = timezone.localtime(end, tz).date()
+    while day <= last_day:
+        for availability in by_weekday.get(day.weekday(), ()):
+            window_start = timezone.make_aware(datetime.combine(day, availability.start_time), tz)
+            window_end = timezone.make_aware(datetime.combine(day, availability.end_time), tz)
+            if window_start < end and window_end > start:
+                windows.setdefault(availability.doctor_id, []).append((window_start, window_end))
+        day += timedelta(days=1)
+    return windows
+
+
+def free_slots(doctor_ids, start, end, slot_minutes=None):
+    """
+    Return {doctor_id: [slot start, ...]} of unbooked slots between start and
+    end, in order. Doctors without Availability rows have no slots.
+    """
+    slot_minutes = slot_minutes or get_slot_minutes()
+    slot_length = timedelta(minutes=slot_minutes)
+    doctor_ids = list(doctor_ids)
+
+    windows = availability_windows(
+        Availability.objects.filter(doctor_id__in=doctor_ids, is_available=True), start, end
+    )
+    booked = {}
+    for doctor_id, booked_start, booked_end in _active_bookings(list(windows), start, end):
+        booked.setdefault(doctor_id, []).append((booked_start, booked_end))
+
+    slots = {doctor_id: [] for doctor_id in doctor_ids}
+    for doctor_id, doctor_windows in windows.items():
+        index = IntervalIndex(booked.get(doctor_id, ()))
+        for window_start, window_end in sorted(doctor_windows):
+            slot_start = window_start
+            while slot_start + slot_length <= window_end:
+                if slot_start >= start and slot_start + slot_length <= end \
+                        and not index.overlaps(slot_start, slot_start + slot_length):
+                    slots[doctor_id].append(slot_start)
+                slot_start += slot_length
+    return slots
+
+
+def _within_availability(doctor_id, start, end):
+    availabilities = list(Availability.objects.filter(doctor_id=doctor_id))
+    if not availabilities:
+        # Doctors who never set weekly hours accept any time.
+        return True
+    windows = availability_windows(availabilities, start, end).get(doctor_id, ())
+    return any(window_start <= start and end <= window_end for window_start, window_end in windows)
+
+
+def check_slot(doctor_id, start, duration_minutes=DEFAULT_APPOINTMENT_DURATION, exclude_id=None,
+               check_availability=True):
+    """Raise SlotUnavailable unless the doctor can take [start, start + duration)."""
+    end = appointment_end(start, duration_minutes)
+    if check_availability and not _within_availability(doctor_id, start, end):
+        raise SlotUnavailable("The doctor is not available at this time. Please choose another time.")
+    if _active_bookings([doctor_id], start, end, exclude_id=exclude_id):
+        raise SlotUnavailable("This time slot is already booked. Please choose another time.")
+
+
+def reserve_slot(appointment, check_availability=True):
+    """
+    Save an appointment if its slot is still free; raise SlotUnavailable
+    otherwise. Concurrent calls for the same doctor are serialised.
+
+    Works for new and existing appointments alike: an existing one never
+    conflicts with itself. Pass check_availability=False for changes that
+    keep the booked time (e.g. confirming a request), so bookings made
+    before the doctor's hours changed can still be processed.
+    """
+    with transaction.atomic():
+        # Lock the doctor row; competing bookings wait here until we commit.
+        list(get_user_model().objects.select_for_update().filter(pk=appointment.doctor_id).values_list('pk'))
+        check_slot(
+            appointment.doctor_id, appointment.appointment_date, appointment.duration_minutes,
+            exclude_id=appointment.pk, check_availability=check_availability,
+        )
+        try:
+            with transaction.atomic():
+                appointment.save()
+        except IntegrityError as exc:
+            if OVERLAP_CONSTRAINT_NAME in str(exc):
+                raise SlotUnavailable("This time slot is already booked. Please choose another time.") from exc
+            raise
+    return appointment
+
+
+def free_slots_cache_key(doctor_id):
+    return f'doctor_free_slots:{doctor_id}'
+
+
+def cached_free_slots(doctor_ids):
+    """
+    Return {doctor_id: [slot start, ...]} covering the next FREE_SLOTS_HORIZON.
+    Cached doctors cost nothing; the rest are computed together with
+    free_slots() and cached.
+    """
+    doctor_ids = list(doctor_ids)
+    keys = {free_slots_cache_key(doctor_id): doctor_id for doctor_id in doctor_ids}
+    slots = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [doctor_id for doctor_id in doctor_ids if doctor_id not in slots]
+    if missing:
+        now = timezone.now()
+        computed = free_slots(missing, now, now + FREE_SLOTS_HORIZON)
+        cache.set_many(
+            {free_slots_cache_key(doctor_id): value for doctor_id, value in computed.items()},
+            FREE_SLOTS_CACHE_TIMEOUT,
+        )
+        slots.update(computed)
+    return slots
+
+
+def next_free_slots(doctor_ids, limit):
+    """The earliest ``limit`` free slots across the doctors, as (start, doctor_id) pairs."""
+    now = timezone.now()
+    candidates = (
+        (start, doctor_id)
+        for doctor_id, starts in cached_free_slots(doctor_ids).items()
+        for start in starts
+        if start >= now
+    )
+    return heapq.nsmallest(limit, candidates)
+
+
+def invalidate_free_slots(doctor_id):
+    cache.delete(free_slots_cache_key(doctor_id))
@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .acl import invalidate_appointment_acl
+from .dashboard import invalidate_doctor_dashboard_counters
+from .models import Appointment, Availability, Notification
+from .notifications import (
+    adjust_unread_notification_count,
+    forget_unread_notification_count,
+    push_notification,
+)
+from .scheduling import invalidate_free_slots
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_changed(sender, instance, **kwargs):
+    invalidate_doctor_dashboard_counters(instance.doctor_id)
+    invalidate_free_slots(instance.doctor_id)
+    invalidate_appointment_acl(instance.id, instance.video_call_room_id)
+
+
+@receiver(post_save, sender=Availability)
+@receiver(post_delete, sender=Availability)
+def availability_changed(sender, instance, **kwargs):
+    invalidate_free_slots(instance.doctor_id)
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, **kwargs):
+    if created:
+        if not instance.is_read:
+            adjust_unread_notification_count(instance.recipient_id, 1)
+            transaction.on_commit(lambda: push_notification(instance))
+    else:
+        # The previous is_read value is unknown here; recount on next read.
+        forget_unread_notification_count(instance.recipient_id)
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    forget_unread_notification_count(instance.recipient_id)
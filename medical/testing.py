@@ -0,0 +1,95 @@
+"""
+Fixtures shared by the test suites: a hospital with a doctor, a patient and
+an appointment between them, and helpers for talking to the consumers
+through WebsocketCommunicator.
+"""
+
+from datetime import timedelta
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .models import Appointment, DoctorProfile, Hospital, PatientProfile
+from .routing import websocket_urlpatterns
+
+
+def create_hospital():
+    return Hospital.objects.create(name='City Hospital', address='Main Road', phone='123', email='city@example.com')
+
+
+def create_user(username, role, password=None, **fields):
+    """A user with an ``<username>@example.com`` address; pass ``password`` to be able to log in."""
+    User = get_user_model()
+    if password is not None:
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com', password=password, role=role, **fields
+        )
+    return User.objects.create(username=username, email=f'{username}@example.com', role=role, **fields)
+
+
+def create_doctor(username, hospital):
+    """A doctor of ``hospital`` with the profile the dashboards require."""
+    doctor = create_user(username, 'doctor', hospital=hospital)
+    DoctorProfile.objects.create(
+        user=doctor, hospital=hospital, license_number=f'LIC-{username}',
+        specialization='General', experience_years=5,
+    )
+    return doctor
+
+
+def create_patient(username, hospital):
+    """A patient of ``hospital`` who has paid the registration fee."""
+    patient = create_user(username, 'patient', hospital=hospital)
+    PatientProfile.objects.create(user=patient, hospital=hospital, payment_status=True)
+    return patient
+
+
+def create_appointment(patient, doctor, hospital, **fields):
+    """An appointment, by default tomorrow at this time."""
+    fields.setdefault('appointment_date', timezone.now() + timedelta(days=1))
+    return Appointment.objects.create(patient=patient, doctor=doctor, hospital=hospital, **fields)
+
+
+class ClinicTestData:
+    """
+    TestCase mixin that creates ``hospital``, ``doctor`` and ``patient`` once
+    per class, plus an ``appointment`` between them built from
+    ``appointment_fields`` unless that is None.
+    """
+
+    appointment_fields = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.hospital = create_hospital()
+        cls.doctor = create_user('doctor', 'doctor')
+        cls.patient = create_user('patient', 'patient')
+        if cls.appointment_fields is not None:
+            cls.appointment = create_appointment(cls.patient, cls.doctor, cls.hospital, **cls.appointment_fields)
+
+
+def socket_communicator(path, user):
+    """A communicator for one of the project's socket routes, authenticated as ``user``."""
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope['user'] = user
+    return communicator
+
+
+async def connect_socket(path, user):
+    """Open a socket as ``user``; fails the test if the consumer refuses it."""
+    communicator = socket_communicator(path, user)
+    connected, code = await communicator.connect()
+    if not connected:
+        raise AssertionError(f'{path} refused {user} with close code {code}')
+    return communicator
+
+
+async def receive_frame(communicator, frame_type, timeout=1):
+    """The next JSON frame of ``frame_type``, skipping any others."""
+    while True:
+        frame = await communicator.receive_json_from(timeout)
+        if frame['type'] == frame_type:
+            return frame
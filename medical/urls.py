@@ -11,6 +11,7 @@ urlpatterns = [
     # Doctors
     path('doctors/', views.doctor_list, name='doctor_list'),
     path('doctors/<int:doctor_id>/', views.doctor_detail, name='doctor_detail'),
+    path('slots/', views.available_slots, name='available_slots'),
     
     # Patients
     path('patients/', views.patient_list, name='patient_list'),
@@ -29,6 +30,8 @@ urlpatterns = [
     path('appointments/<int:appointment_id>/patient-chat/', views.patient_chatbox, name='patient_chatbox'),
     path('appointments/<int:appointment_id>/send-message/', views.send_message, name='send_message'),
     path('appointments/<int:appointment_id>/get-messages/', views.get_chat_messages, name='get_chat_messages'),
+    path('chat/attachments/<int:message_id>/', views.chat_attachment, name='chat_attachment'),
+    path('chat/attachments/<int:message_id>/thumbnail/', views.chat_attachment, {'thumbnail': True}, name='chat_attachment_thumbnail'),
     
     # Video Call
     path('appointments/<int:appointment_id>/video-call/', views.video_call_view, name='video_call'),
@@ -37,6 +40,7 @@ urlpatterns = [
     path('appointments/<int:appointment_id>/video-call/end/', views.end_video_call, name='end_video_call'),
     path('appointments/<int:appointment_id>/video-call/status/', views.get_video_call_status, name='video_call_status'),
     path('video-call/test-devices/', views.test_devices, name='test_devices'),
+    path('video-call/metrics/', views.video_call_metrics, name='video_call_metrics'),
     
     # Waiting Lobby
     path('appointments/<int:appointment_id>/waiting-lobby/', views.waiting_lobby, name='waiting_lobby'),
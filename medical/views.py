@@ -2,13 +2,13 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.http import JsonResponse
 from django.conf import settings
 from django.urls import reverse
-from django.views.decorators.csrf import csrf_exempt
-from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from datetime import datetime
@@ -16,11 +16,43 @@ from urllib.parse import quote, urlparse
 import os
 import json
 import uuid
-from .models import Hospital, DoctorProfile, PatientProfile, Appointment, Availability, ChatMessage, Notification
+from .models import (
+    ACTIVE_APPOINTMENT_STATUSES,
+    Hospital,
+    DoctorProfile,
+    PatientProfile,
+    Appointment,
+    Availability,
+    ChatMessage,
+    Notification,
+)
+from .attachments import (
+    MAX_CHAT_ATTACHMENT_SIZE,
+    ChatAttachmentUploadHandler,
+    attachment_response,
+    schedule_thumbnail,
+)
+from .chat import CHAT_MESSAGE_FIELDS, chat_message_row, serialize_chat_message
+from .listing import paginate_list
+from .read_cursors import get_read_cursors
+from .scheduling import SlotUnavailable, appointment_end, get_slot_minutes, next_free_slots, reserve_slot
 from accounts.decorators import never_cache
 
 User = get_user_model()
-MAX_CHAT_ATTACHMENT_SIZE = 10 * 1024 * 1024  # 10 MB
+CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
+NEXT_SLOTS_LIMIT = 10
+MAX_NEXT_SLOTS_LIMIT = 50
+
+# Sort options for the paginated list pages (see medical.listing).
+PROFILE_LIST_SORTS = {
+    'name': ('Name', ('user__last_name', 'user__first_name')),
+    'newest': ('Newest first', ('-created_at',)),
+}
+APPOINTMENT_LIST_SORTS = {
+    'latest': ('Latest first', ('-appointment_date',)),
+    'earliest': ('Earliest first', ('appointment_date',)),
+}
 
 
 def _allowed_return_paths(appointment):
@@ -53,31 +85,6 @@ def _safe_return_to(request, appointment, default_path):
     return target_path
 
 
-def _serialize_chat_message(message, current_user):
-    local_timestamp = timezone.localtime(message.created_at)
-    attachment_url = message.attachment.url if message.attachment else None
-    attachment_name = os.path.basename(message.attachment.name) if message.attachment else None
-    attachment_size = message.attachment.size if message.attachment else 0
-    extension = os.path.splitext(message.attachment.name)[1].lower() if message.attachment else ''
-    is_image = extension in {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg'}
-
-    return {
-        'id': message.id,
-        'message_id': message.id,
-        'message': message.message,
-        'sender': f"{message.sender.first_name} {message.sender.last_name}",
-        'sender_id': message.sender.id,
-        'created_at': local_timestamp.isoformat(),
-        'created_at_display': local_timestamp.strftime('%I:%M %p').lstrip('0'),
-        'is_self': message.sender_id == current_user.id,
-        'has_attachment': bool(message.attachment),
-        'attachment_url': attachment_url,
-        'attachment_name': attachment_name,
-        'attachment_size': attachment_size,
-        'is_image': is_image,
-    }
-
-
 @never_cache
 @login_required
 def hospital_list(request):
@@ -105,7 +112,13 @@ def doctor_list(request):
             doctors = DoctorProfile.objects.none()
     else:
         doctors = DoctorProfile.objects.select_related('user', 'hospital').all()
-    return render(request, 'medical/doctor_list.html', {'doctors': doctors})
+    page = paginate_list(
+        request,
+        doctors,
+        PROFILE_LIST_SORTS,
+        search_fields=('user__first_name', 'user__last_name', 'specialization'),
+    )
+    return render(request, 'medical/doctor_list.html', {'doctors': page.object_list, 'page': page})
 
 
 @never_cache
@@ -135,6 +148,50 @@ def doctor_detail(request, doctor_id):
     })
 
 
+@never_cache
+@login_required
+def available_slots(request):
+    """
+    Next free appointment slots, either for one doctor (?doctor=<user id>) or
+    for every available doctor of a hospital (?hospital=<id>, optionally
+    narrowed with &specialization=<name>), earliest first.
+    """
+    try:
+        limit = int(request.GET.get('limit') or NEXT_SLOTS_LIMIT)
+        doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+        hospital_id = int(request.GET['hospital']) if request.GET.get('hospital') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid slot parameters.'}, status=400)
+    limit = max(1, min(limit, MAX_NEXT_SLOTS_LIMIT))
+
+    doctors = DoctorProfile.objects.filter(is_available=True).select_related('user')
+    if doctor_id is not None:
+        doctors = doctors.filter(user_id=doctor_id)
+    elif hospital_id is not None:
+        doctors = doctors.filter(hospital_id=hospital_id)
+        specialization = (request.GET.get('specialization') or '').strip()
+        if specialization:
+            doctors = doctors.filter(specialization__iexact=specialization)
+    else:
+        return JsonResponse({'error': 'Pass a doctor or a hospital.'}, status=400)
+
+    doctors = {profile.user_id: profile for profile in doctors}
+    slot_minutes = get_slot_minutes()
+    slots = []
+    for start, slot_doctor_id in next_free_slots(doctors, limit):
+        profile = doctors[slot_doctor_id]
+        slots.append({
+            'doctor_id': slot_doctor_id,
+            'doctor_name': f"Dr. {profile.user.first_name} {profile.user.last_name}",
+            'specialization': profile.specialization,
+            'start': start.isoformat(),
+            'end': appointment_end(start, slot_minutes).isoformat(),
+            # Value for a datetime-local input, in the server's time zone.
+            'local_value': timezone.localtime(start).strftime('%Y-%m-%dT%H:%M'),
+        })
+    return JsonResponse({'success': True, 'slots': slots})
+
+
 @never_cache
 @login_required
 def patient_list(request):
@@ -142,8 +199,13 @@ def patient_list(request):
         messages.error(request, "You don't have permission to view patients.")
         return redirect('dashboard')
     
-    patients = PatientProfile.objects.select_related('user', 'hospital').all()
-    return render(request, 'medical/patient_list.html', {'patients': patients})
+    page = paginate_list(
+        request,
+        PatientProfile.objects.select_related('user', 'hospital'),
+        PROFILE_LIST_SORTS,
+        search_fields=('user__first_name', 'user__last_name', 'user__email'),
+    )
+    return render(request, 'medical/patient_list.html', {'patients': page.object_list, 'page': page})
 
 
 @never_cache
@@ -174,17 +236,23 @@ def appointment_list(request):
     if user.is_doctor:
         appointments = Appointment.objects.filter(
             doctor=user
-        ).select_related('patient', 'hospital').order_by('-appointment_date')
+        ).select_related('patient', 'hospital')
     elif user.is_patient:
         appointments = Appointment.objects.filter(
             patient=user
-        ).select_related('doctor', 'hospital').order_by('-appointment_date')
+        ).select_related('doctor', 'doctor__doctor_profile', 'hospital')
     else:  # admin
         appointments = Appointment.objects.select_related(
-            'patient', 'doctor', 'hospital'
-        ).order_by('-appointment_date')
+            'patient', 'doctor', 'doctor__doctor_profile', 'hospital'
+        )
+    page = paginate_list(
+        request,
+        appointments,
+        APPOINTMENT_LIST_SORTS,
+        filters={'status': ('Statuses', 'status', Appointment.STATUS_CHOICES)},
+    )
     
-    return render(request, 'medical/appointment_list.html', {'appointments': appointments})
+    return render(request, 'medical/appointment_list.html', {'appointments': page.object_list, 'page': page})
 
 
 @never_cache
@@ -222,29 +290,21 @@ def create_appointment(request):
             hospital = Hospital.objects.get(id=hospital_id)
             
             # Parse appointment date
-            from datetime import datetime
-            appointment_datetime = datetime.strptime(appointment_date, '%Y-%m-%dT%H:%M')
+            appointment_datetime = timezone.make_aware(datetime.strptime(appointment_date, '%Y-%m-%dT%H:%M'))
             
-            # Check for conflicts
-            conflict = Appointment.objects.filter(
+            # Overlap and availability checks run under a per-doctor lock
+            appointment = reserve_slot(Appointment(
+                patient=request.user,
                 doctor=doctor,
+                hospital=hospital,
                 appointment_date=appointment_datetime,
-                status__in=['scheduled', 'confirmed', 'in_progress']
-            ).exists()
-            
-            if conflict:
-                messages.error(request, "This time slot is already booked. Please choose another time.")
-            else:
-                appointment = Appointment.objects.create(
-                    patient=request.user,
-                    doctor=doctor,
-                    hospital=hospital,
-                    appointment_date=appointment_datetime,
-                    symptoms=symptoms
-                )
-                messages.success(request, f"Appointment scheduled with Dr. {doctor.first_name} {doctor.last_name}!")
-                return redirect('medical:appointment_detail', appointment_id=appointment.id)
+                symptoms=symptoms
+            ))
+            messages.success(request, f"Appointment scheduled with Dr. {doctor.first_name} {doctor.last_name}!")
+            return redirect('medical:appointment_detail', appointment_id=appointment.id)
                 
+        except SlotUnavailable as e:
+            messages.error(request, str(e))
         except (User.DoesNotExist, Hospital.DoesNotExist, ValueError) as e:
             messages.error(request, "Invalid selection. Please try again.")
     
@@ -274,8 +334,16 @@ def update_appointment_status(request, appointment_id):
         if new_status in dict(Appointment.STATUS_CHOICES):
             appointment.status = new_status
             appointment.updated_at = timezone.now()
-            appointment.save()
-            messages.success(request, f"Appointment status updated to {appointment.get_status_display()}.")
+            try:
+                if new_status in ACTIVE_APPOINTMENT_STATUSES:
+                    # Reactivating a booking must not overlap one made since.
+                    reserve_slot(appointment, check_availability=False)
+                else:
+                    appointment.save()
+            except SlotUnavailable as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, f"Appointment status updated to {appointment.get_status_display()}.")
         else:
             messages.error(request, "Invalid status.")
     
@@ -321,29 +389,9 @@ def chat_view(request, appointment_id):
         messages.error(request, "You don't have permission to access this chat.")
         return redirect('dashboard')
     
-    # Get chat messages
-    chat_messages = ChatMessage.objects.filter(
-        appointment=appointment
-    ).select_related('sender').order_by('created_at')
-    
-    # Mark messages as read if user is not the sender
-    if user == appointment.doctor:
-        ChatMessage.objects.filter(
-            appointment=appointment,
-            sender=appointment.patient,
-            is_read=False
-        ).update(is_read=True)
-    elif user == appointment.patient:
-        ChatMessage.objects.filter(
-            appointment=appointment,
-            sender=appointment.doctor,
-            is_read=False
-        ).update(is_read=True)
-    
-    return render(request, 'medical/chat.html', {
-        'appointment': appointment,
-        'messages': chat_messages
-    })
+    # The page is rendered once; history is loaded from get_chat_messages and
+    # kept current (including read cursors) over the chat socket.
+    return render(request, 'medical/chat.html', {'appointment': appointment})
 
 
 @never_cache
@@ -378,9 +426,18 @@ def patient_chatbox(request, appointment_id):
     return render(request, 'medical/patient_chatbox.html', {'appointment': appointment})
 
 
+@csrf_exempt
+def send_message(request, appointment_id):
+    # The upload handler must be installed before anything reads the body,
+    # so CSRF is checked by _send_message rather than the middleware.
+    request.upload_handlers = [ChatAttachmentUploadHandler(request)]
+    return _send_message(request, appointment_id)
+
+
 @never_cache
 @login_required
-def send_message(request, appointment_id):
+@csrf_protect
+def _send_message(request, appointment_id):
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST method allowed'}, status=405)
     
@@ -394,6 +451,9 @@ def send_message(request, appointment_id):
     message_text = request.POST.get('message', '').strip()
     attachment = request.FILES.get('attachment')
 
+    if any(getattr(handler, 'too_large', False) for handler in request.upload_handlers):
+        return JsonResponse({'error': 'File size must be 10MB or less.'}, status=400)
+
     if not message_text and not attachment:
         return JsonResponse({'error': 'Message cannot be empty.'}, status=400)
 
@@ -406,8 +466,9 @@ def send_message(request, appointment_id):
         message=message_text,
         attachment=attachment
     )
+    schedule_thumbnail(message)
 
-    response_payload = _serialize_chat_message(message, user)
+    response_payload = serialize_chat_message(chat_message_row(message), user)
     response_payload['success'] = True
 
     channel_layer = get_channel_layer()
@@ -424,10 +485,63 @@ def send_message(request, appointment_id):
     return JsonResponse(response_payload)
 
 
+@login_required
+def chat_attachment(request, message_id, thumbnail=False):
+    """Download a chat attachment (or its thumbnail) with Range and ETag support."""
+    message = get_object_or_404(ChatMessage.objects.select_related('appointment'), id=message_id)
+    user = request.user
+    appointment = message.appointment
+    if not (user.is_admin_user or user.id in (appointment.patient_id, appointment.doctor_id)):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+
+    name = message.attachment_name or os.path.basename(message.attachment.name or '')
+    if thumbnail:
+        if not message.attachment_thumbnail:
+            return JsonResponse({'error': 'Thumbnail not available'}, status=404)
+        field_file = message.attachment_thumbnail
+        size = field_file.size
+        content_type = 'image/png' if field_file.name.endswith('.png') else 'image/jpeg'
+        inline = True
+    else:
+        if not message.attachment:
+            return JsonResponse({'error': 'Attachment not found'}, status=404)
+        field_file = message.attachment
+        size = message.attachment_size or field_file.size
+        content_type = message.content_type or 'application/octet-stream'
+        # Anything that is not a verified raster image is downloaded, never rendered.
+        inline = message.is_image
+
+    return attachment_response(request, field_file, size, content_type, name, inline)
+
+
+def _parse_since(value):
+    """Parse a legacy ``since`` timestamp; a ``+`` in its offset may arrive as a space."""
+    value = value.strip()
+    if ' ' in value and '+' not in value and 'T' in value:
+        date_part, offset_part = value.rsplit(' ', 1)
+        if ':' in offset_part:
+            value = f'{date_part}+{offset_part}'
+    since = parse_datetime(value)
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
 @never_cache
 @login_required
 def get_chat_messages(request, appointment_id):
-    """Get chat messages for an appointment (AJAX endpoint)"""
+    """
+    Get a page of chat messages for an appointment (AJAX endpoint).
+
+    Pages are keyed on ChatMessage.id:
+    - ``after_id``: messages newer than the id, oldest first (catch-up/polling)
+    - ``before_id``: messages older than the id (the "load older" mode)
+    - neither: the most recent page
+    ``has_more`` tells whether another page exists in the requested direction.
+
+    ``since`` (an ISO timestamp) is still accepted from pages loaded before
+    keyset paging; it is paged like ``after_id``.
+    """
     appointment = get_object_or_404(Appointment, id=appointment_id)
     user = request.user
     
@@ -435,30 +549,46 @@ def get_chat_messages(request, appointment_id):
     if not (user.is_admin_user or user == appointment.patient or user == appointment.doctor):
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    # Get messages since a specific time (for polling)
-    since = request.GET.get('since')
-    messages_query = ChatMessage.objects.filter(appointment=appointment).select_related('sender')
-    
-    if since:
-        normalized_since = since.strip()
-        if ' ' in normalized_since and '+' not in normalized_since and 'T' in normalized_since:
-            date_part, offset_part = normalized_since.rsplit(' ', 1)
-            if ':' in offset_part:
-                normalized_since = f'{date_part}+{offset_part}'
-
-        since_time = parse_datetime(normalized_since)
-        if since_time:
-            if timezone.is_naive(since_time):
-                since_time = timezone.make_aware(since_time)
-            messages_query = messages_query.filter(created_at__gt=since_time)
-    
-    messages_query = messages_query.order_by('created_at')
+    try:
+        after_id = int(request.GET['after_id']) if request.GET.get('after_id') else None
+        before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+        limit = int(request.GET.get('limit') or CHAT_PAGE_SIZE)
+        since = _parse_since(request.GET['since']) if request.GET.get('since') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters.'}, status=400)
+
+    if after_id is not None and before_id is not None:
+        return JsonResponse({'error': 'Use either after_id or before_id, not both.'}, status=400)
+    if after_id is not None or before_id is not None:
+        since = None
+
+    limit = max(1, min(limit, MAX_CHAT_PAGE_SIZE))
+    messages_query = ChatMessage.objects.filter(appointment=appointment).values(*CHAT_MESSAGE_FIELDS)
+
+    if after_id is not None or since is not None:
+        if after_id is not None:
+            messages_query = messages_query.filter(id__gt=after_id)
+        else:
+            messages_query = messages_query.filter(created_at__gt=since)
+        page = list(messages_query.order_by('id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+    else:
+        if before_id is not None:
+            messages_query = messages_query.filter(id__lt=before_id)
+        page = list(messages_query.order_by('-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit][::-1]
     
-    messages_data = [_serialize_chat_message(msg, user) for msg in messages_query]
+    messages_data = [serialize_chat_message(row, user) for row in page]
     
     return JsonResponse({
         'success': True,
-        'messages': messages_data
+        'messages': messages_data,
+        'has_more': has_more,
+        'first_id': page[0]['id'] if page else None,
+        'last_id': page[-1]['id'] if page else None,
+        'read_cursors': get_read_cursors(appointment.id),
     })
 
 
@@ -698,6 +828,21 @@ def get_video_call_status(request, appointment_id):
     })
 
 
+@never_cache
+@login_required
+def video_call_metrics(request):
+    """Signaling frame counters of this worker process (staff only, JSON)."""
+    if not (request.user.is_staff or request.user.is_super_admin):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+
+    from .consumers import VideoCallConsumer
+    return JsonResponse({
+        'pid': os.getpid(),
+        'open_sockets': dict(VideoCallConsumer.room_sockets),
+        **VideoCallConsumer.get_frame_counts(),
+    })
+
+
 @never_cache
 @login_required
 def waiting_lobby(request, appointment_id):
@@ -716,7 +861,8 @@ def waiting_lobby(request, appointment_id):
         messages.error(request, 'You do not have permission to access this waiting lobby.')
         return redirect('accounts:dashboard')
     
-    # Check if appointment is scheduled, confirmed, or rescheduled
+    # Check if appointment is scheduled or confirmed. 'rescheduled' is only
+    # left on rows migration 0018 could not move back to 'scheduled'.
     if appointment.status not in ['scheduled', 'confirmed', 'rescheduled']:
         messages.warning(request, 'This appointment is not scheduled.')
         return redirect('accounts:dashboard')
@@ -782,10 +928,15 @@ def update_appointment_time(request, appointment_id):
         # Store old date for notification
         old_date = appointment.appointment_date
         
-        # Update appointment
+        # Update appointment; the new time goes through the same overlap
+        # and availability checks as a new booking. It stays 'scheduled' so
+        # it keeps holding the new slot.
         appointment.appointment_date = new_time
-        appointment.status = 'rescheduled'
-        appointment.save()
+        appointment.status = 'scheduled'
+        try:
+            reserve_slot(appointment)
+        except SlotUnavailable as e:
+            return JsonResponse({'error': str(e)}, status=409)
         
         # Create notification for patient
         Notification.objects.create(
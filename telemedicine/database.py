@@ -0,0 +1,45 @@
+"""
+DATABASES["default"] for a DATABASE_URL, per connection strategy
+(DB_CONNECTION_MODE, see settings.py).
+"""
+
+import os
+
+import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
+
+DB_CONNECTION_MODES = ("none", "persistent", "pool")
+
+
+def database_config(database_url, mode="none", environ=os.environ):
+    mode = mode.lower()
+    if mode not in DB_CONNECTION_MODES:
+        raise ImproperlyConfigured(
+            f"DB_CONNECTION_MODE must be one of {', '.join(DB_CONNECTION_MODES)}, not {mode!r}."
+        )
+
+    if mode == "persistent":
+        db_config = dj_database_url.parse(
+            database_url,
+            conn_max_age=int(environ.get("DB_CONN_MAX_AGE", "60")),
+            conn_health_checks=True,
+        )
+    else:
+        # Django's pool requires CONN_MAX_AGE = 0.
+        db_config = dj_database_url.parse(database_url, conn_max_age=0)
+
+    if mode == "pool":
+        db_config.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": int(environ.get("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(environ.get("DB_POOL_MAX_SIZE", "10")),
+            "timeout": int(environ.get("DB_POOL_TIMEOUT", "10")),
+        }
+
+    # Supabase's transaction-mode pooler (port 6543) cannot keep server-side
+    # cursors or prepared statements across transactions.
+    if str(db_config.get("PORT")) == "6543":
+        db_config["DISABLE_SERVER_SIDE_CURSORS"] = True
+        if mode == "pool":
+            db_config["OPTIONS"]["prepare_threshold"] = None
+
+    return db_config
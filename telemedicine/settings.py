@@ -12,9 +12,10 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 import os
 import importlib.util
-import dj_database_url
 from pathlib import Path
 
+from telemedicine.database import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -57,6 +58,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "accounts.middleware.PrincipalMiddleware",  # Cached role/profile summary as request.principal
     "accounts.decorators.DisableClientSideCachingMiddleware",  # Disable caching for real-time updates
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -93,13 +95,19 @@ ASGI_APPLICATION = "telemedicine.asgi.application"  # Django Channels ASGI
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# Connection strategy (DB_CONNECTION_MODE):
+# - "none":       open/close a connection per request (default)
+# - "persistent": reuse connections for DB_CONN_MAX_AGE seconds, with health
+#                 checks so connections dropped by the pooler are replaced.
+#                 Only for WSGI: under Daphne/ASGI every request runs in its
+#                 own thread, so connections are never reused and pile up
+#                 against the Supabase pooler.
+# - "pool":       psycopg 3 connection pool (needs psycopg[pool] installed);
+#                 shared across threads, so it also works under ASGI
+DB_CONNECTION_MODE = os.environ.get("DB_CONNECTION_MODE", "none").lower()
+
 if DATABASE_URL:
-    DATABASES = {
-        "default": dj_database_url.parse(
-            DATABASE_URL,
-            conn_max_age=0,  # No persistent connections - required for Supabase pooler
-        )
-    }
+    DATABASES = {"default": database_config(DATABASE_URL, DB_CONNECTION_MODE)}
 else:
     DATABASES = {
         "default": {
@@ -150,6 +158,10 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Chat attachments: thumbnails are generated off the request path by this
+# many worker threads per process (see medical/attachments.py).
+CHAT_THUMBNAIL_WORKERS = int(os.environ.get("CHAT_THUMBNAIL_WORKERS", "2"))
+
 # WhiteNoise configuration with compression for static files
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
@@ -185,12 +197,26 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Custom User Model
 AUTH_USER_MODEL = "accounts.User"
 
+# Session users are loaded from the cache (see accounts/principal.py).
+# ModelBackend stays listed so sessions created before the switch stay valid.
+AUTHENTICATION_BACKENDS = [
+    "accounts.backends.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
 # Khalti Payment Gateway Configuration (ePayment API v2)
 KHALTI_PUBLIC_KEY = os.environ.get("KHALTI_PUBLIC_KEY", "117e2f1f48d84b52a47ef8fdf4623f5f")
 KHALTI_SECRET_KEY = os.environ.get("KHALTI_SECRET_KEY", "1753221752054f0bbed8c345b7dd6b65")
 # Use test environment for now
 KHALTI_GATEWAY_URL = "https://a.khalti.com/api/v2/epayment/initiate/"
 KHALTI_VERIFY_URL = "https://a.khalti.com/api/v2/epayment/lookup/"
+# Gateway client limits (see accounts/khalti.py).
+KHALTI_CONNECT_TIMEOUT = float(os.environ.get("KHALTI_CONNECT_TIMEOUT", "3.05"))  # seconds
+KHALTI_READ_TIMEOUT = float(os.environ.get("KHALTI_READ_TIMEOUT", "10"))  # seconds
+KHALTI_MAX_RETRIES = int(os.environ.get("KHALTI_MAX_RETRIES", "2"))
+
+# Length of the bookable slots generated from doctors' weekly Availability.
+APPOINTMENT_SLOT_MINUTES = int(os.environ.get("APPOINTMENT_SLOT_MINUTES", "30"))
 
 
 
@@ -214,6 +240,30 @@ else:
         },
     }
 
+# Chat presence registry. Redis makes "online" status visible across all
+# WebSocket workers; sockets expire CHAT_PRESENCE_TTL seconds after their
+# last heartbeat.
+CHAT_PRESENCE_BACKEND = (
+    "medical.presence.RedisPresenceBackend" if REDIS_URL else "medical.presence.InMemoryPresenceBackend"
+)
+CHAT_PRESENCE_TTL = 90  # seconds
+
+# Typing indicators: each chat socket broadcasts at most one typing change per
+# CHAT_TYPING_MIN_INTERVAL, and "typing" lapses if the client sends nothing
+# for CHAT_TYPING_EXPIRY (clients refresh it every few seconds while typing).
+CHAT_TYPING_MIN_INTERVAL = float(os.environ.get("CHAT_TYPING_MIN_INTERVAL", "0.5"))  # seconds
+CHAT_TYPING_EXPIRY = float(os.environ.get("CHAT_TYPING_EXPIRY", "6"))  # seconds
+
+# Write-behind persistence for chat socket messages (see medical/chat_writer.py).
+# Messages are broadcast immediately and bulk-inserted every
+# CHAT_WRITE_BEHIND_FLUSH_INTERVAL seconds; the journal directory must be on
+# persistent local disk so a crashed worker's messages can be replayed.
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "False") == "True"
+CHAT_WRITE_BEHIND_JOURNAL_DIR = os.environ.get("CHAT_WRITE_BEHIND_JOURNAL_DIR", str(BASE_DIR / "chat_journal"))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get("CHAT_WRITE_BEHIND_FLUSH_INTERVAL", "0.01"))  # seconds
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("CHAT_WRITE_BEHIND_BATCH_SIZE", "100"))
+CHAT_WRITE_BEHIND_ID_BLOCK = int(os.environ.get("CHAT_WRITE_BEHIND_ID_BLOCK", "1"))
+
 # Redis Caching Configuration (CRITICAL FOR PERFORMANCE)
 # This significantly improves page load times by caching queries and sessions
 if REDIS_URL:
@@ -280,3 +330,6 @@ WEBRTC_TURN_SERVERS = [
 VIDEO_CALL_MAX_DURATION = 60  # minutes
 VIDEO_CALL_DEFAULT_FEE = 500.00  # NPR
 VIDEO_CALL_TOKEN_EXPIRY = 24  # hours
+# ICE candidates from one peer that arrive within this window are forwarded
+# as a single channel-layer message (0 disables coalescing).
+VIDEO_CALL_ICE_BATCH_WINDOW = float(os.environ.get("VIDEO_CALL_ICE_BATCH_WINDOW", "0.05"))  # seconds